@@ -12,3 +12,5 @@ HEADER_AUTHORIZATION_FORMAT = '%s mchid=\"%s\",nonce_str=\"%s\",timestamp=\"%d\"
 
 # 默认超时时间
 DEFAULT_TIMEOUT = 30
+# 默认连接超时时间, 仅在使用 TimeoutPolicy 时生效
+DEFAULT_CONNECT_TIMEOUT = 5
@@ -1,51 +1,112 @@
-from json import dumps
-from urllib.parse import urlparse
+import asyncio
+import functools
+import random
+import time
+from base64 import b64decode
+from json import dumps, loads
+from urllib.parse import urlparse, urlencode
 
-import requests
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.hashes import SHA256
 
 from .credential import WechatPayCredential
 from .downloader_mgr import mgr_instance
 from .signer import Sha256WithRSASigner, SignatureResult
+from .timeout import TimeoutPolicy, current_deadline
+from .transport import Transport, RequestsTransport
 from .validator import WechatPayResponseValidator
 from .verifier import SHA256WithRSAVerifier
-from ..constants import VERSION, USER_AGENT_FORMAT, DEFAULT_TIMEOUT
-from ..exceptions import WechatPayAPIException
+from ..constants import VERSION, USER_AGENT_FORMAT, DEFAULT_TIMEOUT, WECHAT_PAY_API_SERVER
+from ..exceptions import WechatPayAPIException, WechatPayTimeoutException
 from ..utils.pem import load_private_key
 
 
 class Client:
-    def __init__(self, signer=None, credential=None, validator=None, cipher=None):
+    def __init__(self, signer=None, credential=None, validator=None, cipher=None, http_client=None,
+                 timeout_policy: TimeoutPolicy = None, retries: int = 0, transport: Transport = None,
+                 retry_backoff: float = 0.1):
         """
 
         :param signer: 签名器
         :param credential: 认证器
         :param validator: 验证器
         :param cipher: 加解密器
+        :param http_client: requests 会话, 不传则新建一个 requests.Session. 指定 transport 时忽略
+        :param timeout_policy: 超时策略, 不传则所有请求使用 DEFAULT_TIMEOUT
+        :param retries: 连接失败或超时后的重试次数
+        :param transport: HTTP 传输层, 不传则使用 RequestsTransport
+        :param retry_backoff: 第一次重试前的最长等待秒数, 之后每次翻倍, 实际等待时间在 [0, 最长等待) 之间随机,
+            且不超过截止时间
         """
         self.signer = signer
         self.credential = credential
         self.validator = validator
         self.cipher = cipher
+        self.timeout_policy = timeout_policy
+        self.retries = retries
+        self.retry_backoff = retry_backoff
 
-        self.http_client = requests.Session()
+        self.transport = transport or RequestsTransport(http_client)
+        # requests 会话, 使用其他传输层时为 None
+        self.http_client = getattr(self.transport, "session", None)
 
-    def request(self, method, url, params=None, data=None, json=None, headers={}, **kwargs):
-        body = data or json
+    def request(self, method, url, params=None, data=None, json=None, headers=None, deadline: float = None,
+                **kwargs):
+        """
+        发送请求, 自动签名和验签
+
+        :param deadline: 截止时间, time.monotonic() 格式, 覆盖所有重试. 也可以用 core.timeout.deadline 设置
+        :param kwargs: 传给传输层的其他参数
+        :return:
+        """
+        if params:
+            url = url + ("&" if "?" in url else "?") + urlencode(params)
+        body = data if data is not None else json
         sign_body = body if isinstance(body, str) else dumps(body) if body else ""
         up = urlparse(url)
         query = f"?{up.query}" if up.query else ""
         path = up.path + query
-        authorization = self.credential.gen_authorization_header(method, path, sign_body)
-        _headers = {
-            "User-Agent": USER_AGENT_FORMAT % VERSION,
-            "Authorization": authorization,
-        }
-        headers.update(_headers)
 
-        if "timeout" not in kwargs:
-            kwargs["timeout"] = DEFAULT_TIMEOUT
-
-        response = self.http_client.request(method, url, params, data, headers=headers, json=json, **kwargs)
+        context_deadline = current_deadline()
+        if context_deadline is not None:
+            deadline = context_deadline if deadline is None else min(deadline, context_deadline)
+        timeout = kwargs.pop("timeout", None)
+
+        attempt = 0
+        while True:
+            attempt_timeout = self._attempt_timeout(method, up.path, timeout, deadline)
+            authorization = self.credential.gen_authorization_header(method, path, sign_body)
+            _headers = {
+                "User-Agent": USER_AGENT_FORMAT % VERSION,
+                "Authorization": authorization,
+            }
+            attempt_headers = {"Accept": "application/json"}
+            if sign_body:
+                attempt_headers["Content-Type"] = "application/json"
+            attempt_headers.update(headers or {})
+            attempt_headers.update(_headers)
+
+            start = time.monotonic()
+            try:
+                response = self.transport.request(method, url, attempt_headers, sign_body.encode() or None,
+                                                  timeout=attempt_timeout, **kwargs)
+            except self.transport.retryable_exceptions as ex:
+                if self.timeout_policy and self.transport.is_timeout(ex):
+                    # 超时也计入样本, 网络变慢时自适应超时可以随之增大
+                    self.timeout_policy.observe(method, up.path, time.monotonic() - start)
+                attempt += 1
+                self._check_deadline(deadline, method, up.path, attempt, ex)
+                if attempt > self.retries:
+                    raise
+                self._sleep_before_retry(attempt, deadline)
+                self._check_deadline(deadline, method, up.path, attempt, ex)
+                continue
+            if self.timeout_policy:
+                self.timeout_policy.observe(method, up.path, time.monotonic() - start)
+            # 读取超时限制的是两次收到数据的间隔, 应答持续缓慢到达时总耗时仍可能超过截止时间
+            if deadline is not None and time.monotonic() > deadline:
+                raise WechatPayTimeoutException(f"response of {method.upper()} {up.path} arrived after the deadline")
+            break
 
         # check is success
         self.check_response(response)
@@ -55,12 +116,95 @@ class Client:
 
         return response
 
+    def _attempt_timeout(self, method: str, path: str, timeout, deadline: float):
+        if timeout is None:
+            timeout = self.timeout_policy.get_timeout(method, path) if self.timeout_policy else DEFAULT_TIMEOUT
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise WechatPayTimeoutException(f"deadline exceeded before {method.upper()} {path}")
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        connect = remaining if connect is None else connect
+        read = remaining if read is None else read
+        if connect + read > remaining:
+            # 连接和读取分别计时, 按比例分配剩余时间, 使两者之和不超过剩余时间
+            scale = remaining / (connect + read)
+            connect, read = connect * scale, read * scale
+        return connect, read
+
+    @staticmethod
+    def _check_deadline(deadline: float, method: str, path: str, attempts: int, ex: Exception):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise WechatPayTimeoutException(f"deadline exceeded after {attempts} attempts of {method.upper()} {path}: "
+                                            f"{ex}") from ex
+
+    def _sleep_before_retry(self, attempt: int, deadline: float):
+        delay = random.uniform(0, self.retry_backoff * 2 ** (attempt - 1))
+        if deadline is not None:
+            delay = min(delay, max(deadline - time.monotonic(), 0))
+        if delay > 0:
+            time.sleep(delay)
+
     @staticmethod
     def check_response(resp):
         if 200 <= resp.status_code <= 299:
             return
 
-        raise WechatPayAPIException(resp.text)
+        try:
+            code = resp.json().get("code")
+        except (ValueError, AttributeError):
+            code = None
+        raise WechatPayAPIException(resp.text, status_code=resp.status_code, code=code)
+
+    def warm_up(self, connections: int = 4, api_server: str = WECHAT_PAY_API_SERVER, timeout: float = 5) -> dict:
+        """
+        预热, 让之后的请求不再承担首次调用的开销. 可在就绪检查中调用
+
+        依次完成: 用签名器做一次签名并用商户公钥验证; 载入所有已知平台证书的公钥并各做一次验签;
+        预热 JSON 编解码; 预先建立 connections 个连接并放回连接池.
+        返回各步骤的耗时(秒)和结果, 建立连接失败不会抛出异常, 可通过 opened_connections 判断.
+        opened_connections 不会超过连接池为该 host 保留的连接数, HTTP/2 下为 1
+
+        :param connections: 预先建立的连接数, 超过连接池大小时按连接池大小计算
+        :param api_server: 微信支付 API 地址
+        :param timeout: 建立连接的超时时间
+        :return:
+        """
+        report = {}
+        total_start = time.perf_counter()
+
+        start = time.perf_counter()
+        message = "pywechatpay warm-up\n"
+        signature = self.signer.sign(message).signature if self.signer else None
+        private_key = getattr(self.signer, "private_key", None)
+        if signature and private_key is not None:
+            private_key.public_key().verify(b64decode(signature), str.encode(message), PKCS1v15(), SHA256())
+        report["sign"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        verifier = getattr(self.validator, "verifier", None)
+        report["public_keys"] = verifier.warm_up() if hasattr(verifier, "warm_up") else 0
+        report["verifier"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loads(dumps({"mchid": "", "out_trade_no": "", "amount": {"total": 1, "currency": "CNY"}}))
+        report["json"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report["opened_connections"] = self.transport.warm_up(api_server + "/", connections, timeout) \
+            if connections > 0 else 0
+        report["connections"] = time.perf_counter() - start
+
+        report["total"] = time.perf_counter() - total_start
+        return report
+
+    async def warm_up_async(self, connections: int = 4, api_server: str = WECHAT_PAY_API_SERVER,
+                            timeout: float = 5) -> dict:
+        """warm_up 的异步版本, 在默认线程池中执行, 不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.warm_up, connections, api_server, timeout))
 
     def sign(self, message: str) -> SignatureResult:
         """
@@ -73,7 +217,7 @@ class Client:
 
 
 def with_wechat_pay_auto_auth_cipher_using_downloader_mgr(mch_id: str, mch_cert_serial_no: str, mch_private_key: str,
-                                                          mgr) -> Client:
+                                                          mgr, http_client=None, transport=None) -> Client:
     """一键初始化 Client，使其具备「签名/验签/敏感字段加解密」能力。
        需要使用者自行提供 CertificateDownloaderMgr 实现平台证书的自动更新
     """
@@ -83,7 +227,8 @@ def with_wechat_pay_auto_auth_cipher_using_downloader_mgr(mch_id: str, mch_cert_
     signer = Sha256WithRSASigner(mch_id, mch_cert_serial_no, private_key)
     credential = WechatPayCredential(signer)
     validator = WechatPayResponseValidator(SHA256WithRSAVerifier(cert_visitor))
-    return Client(signer=signer, credential=credential, validator=validator)
+    return Client(signer=signer, credential=credential, validator=validator, http_client=http_client,
+                  transport=transport)
 
 
 def with_wechat_pay_auto_auth_cipher(mch_id: str, mch_cert_serial_no: str, mch_private_key: str,
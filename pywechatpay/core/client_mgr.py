@@ -0,0 +1,108 @@
+import threading
+
+from .client import Client, with_wechat_pay_auto_auth_cipher_using_downloader_mgr
+from .downloader_mgr import mgr_instance
+from .transport import Transport, RequestsTransport
+from ..constants import WECHAT_PAY_API_SERVER
+from ..exceptions import WechatPayException
+
+
+class ClientMgr:
+    """Client 管理器
+
+    按 (商户号, 商户证书序列号) 缓存 Client, 私钥只解析一次. 所有 Client 以及由本管理器注册的证书下载器
+    共用同一个 HTTP 连接池. 可在多线程中共享使用, 关闭后不能再获取 Client.
+    首次创建 Client 时要下载平台证书, 只对同一商户号加锁, 不会阻塞其他商户
+    """
+
+    def __init__(self, downloader_mgr=None, pool_connections: int = 10, pool_maxsize: int = 10,
+                 transport: Transport = None, api_server: str = WECHAT_PAY_API_SERVER):
+        """
+
+        :param downloader_mgr: 证书下载管理器, 默认使用 mgr_instance
+        :param pool_connections: 连接池缓存的 host 数量
+        :param pool_maxsize: 每个 host 的最大连接数
+        :param transport: 共用的 HTTP 传输层, 不传则按上面两个参数新建 RequestsTransport
+        :param api_server: 注册证书下载器时使用的微信支付 API 地址
+        """
+        self.downloader_mgr = downloader_mgr or mgr_instance
+        self.api_server = api_server
+        self.client_map = {}
+        # lock 保护 client_map, mch_locks 和 closed; mch_locks 按商户号串行化 Client 的创建
+        self.lock = threading.Lock()
+        self.mch_locks = {}
+        self.closed = False
+
+        self.transport = transport or RequestsTransport(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+    def get_client(self, mch_id: str, mch_cert_serial_no: str, mch_private_key: str, mch_api_v3_key: str) -> Client:
+        """
+        获取商户的 Client, 不存在时创建并缓存
+
+        :param mch_id: 商户号
+        :param mch_cert_serial_no: 商户证书序列号
+        :param mch_private_key: 商户证书私钥
+        :param mch_api_v3_key: 商户APIv3密钥
+        :return:
+        """
+        key = (mch_id, mch_cert_serial_no)
+        client = self.client_map.get(key)
+        if client is not None:
+            return client
+
+        with self.lock:
+            if self.closed:
+                raise WechatPayException("client manager is closed")
+            mch_lock = self.mch_locks.setdefault(mch_id, threading.Lock())
+
+        with mch_lock:
+            client = self.client_map.get(key)
+            if client is not None:
+                return client
+            if not self.downloader_mgr.has_downloader(mch_id):
+                self.downloader_mgr.register_downloader_with_private_key(mch_id=mch_id,
+                                                                         mch_cert_serial_no=mch_cert_serial_no,
+                                                                         mch_private_key=mch_private_key,
+                                                                         mch_api_v3_key=mch_api_v3_key,
+                                                                         api_server=self.api_server,
+                                                                         transport=self.transport)
+            client = with_wechat_pay_auto_auth_cipher_using_downloader_mgr(mch_id, mch_cert_serial_no,
+                                                                           mch_private_key, self.downloader_mgr,
+                                                                           transport=self.transport)
+            with self.lock:
+                if self.closed:
+                    raise WechatPayException("client manager is closed")
+                self.client_map[key] = client
+        return client
+
+    def has_client(self, mch_id: str, mch_cert_serial_no: str) -> bool:
+        """
+        检查是否已经缓存了该商户的 Client
+
+        :param mch_id: 商户号
+        :param mch_cert_serial_no: 商户证书序列号
+        :return:
+        """
+        return (mch_id, mch_cert_serial_no) in self.client_map
+
+    def evict(self, mch_id: str, mch_cert_serial_no: str):
+        """
+        移除缓存的 Client, 如商户更换证书后调用. 共用的连接池不会被关闭
+
+        :param mch_id: 商户号
+        :param mch_cert_serial_no: 商户证书序列号
+        :return:
+        """
+        with self.lock:
+            return self.client_map.pop((mch_id, mch_cert_serial_no), None)
+
+    def close(self):
+        """移除所有缓存的 Client 并关闭连接池, 之后调用 get_client 会抛出异常"""
+        with self.lock:
+            self.closed = True
+            self.client_map.clear()
+            self.transport.close()
+
+
+# Client 管理器单例
+client_mgr_instance = ClientMgr()
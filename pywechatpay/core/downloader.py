@@ -11,9 +11,10 @@ from ..utils.pem import load_certificate, load_private_key
 class CertificateDownloader:
     """证书下载器"""
 
-    def __init__(self, client, mch_api_v3_key: str):
+    def __init__(self, client, mch_api_v3_key: str, api_server: str = WECHAT_PAY_API_SERVER):
         self.client = client
         self.mch_api_v3_key = mch_api_v3_key
+        self.api_server = api_server
 
         self.cert_contents = {}
         self.certificates = {}
@@ -27,13 +28,17 @@ class CertificateDownloader:
         """
         return self.certificates.get(serial_no)
 
+    def get_all(self) -> dict:
+        """获取所有平台证书, 证书序列号 -> 证书"""
+        return dict(self.certificates)
+
     def get_newest_serial(self):
         """获取最新的平台证书的证书序列号"""
         return ""
 
     def download_certificates(self):
         """立即下载平台证书列表"""
-        url = WECHAT_PAY_API_SERVER + "/v3/certificates"
+        url = self.api_server + "/v3/certificates"
         result = self.client.request("get", url)
         data = result.json()
         raw_cert_content_map = {}
@@ -66,14 +71,16 @@ class CertificateDownloader:
         self.client.validator = WechatPayResponseValidator(SHA256WithRSAVerifier(certificates))
 
 
-def new_certificate_downloader_with_client(client, mch_api_v3_key: str) -> CertificateDownloader:
-    downloader = CertificateDownloader(client=client, mch_api_v3_key=mch_api_v3_key)
+def new_certificate_downloader_with_client(client, mch_api_v3_key: str,
+                                           api_server: str = WECHAT_PAY_API_SERVER) -> CertificateDownloader:
+    downloader = CertificateDownloader(client=client, mch_api_v3_key=mch_api_v3_key, api_server=api_server)
     downloader.download_certificates()
     return downloader
 
 
 def new_certificate_downloader(mch_id: str, mch_cert_serial_no: str, mch_private_key: str,
-                               mch_api_v3_key: str) -> CertificateDownloader:
+                               mch_api_v3_key: str, api_server: str = WECHAT_PAY_API_SERVER,
+                               transport=None) -> CertificateDownloader:
     """
     创建证书下载器
 
@@ -81,6 +88,8 @@ def new_certificate_downloader(mch_id: str, mch_cert_serial_no: str, mch_private
     :param mch_cert_serial_no:
     :param mch_private_key:
     :param mch_api_v3_key:
+    :param api_server: 微信支付 API 地址
+    :param transport: HTTP 传输层, 不传则新建
     :return:
     """
     private_key = load_private_key(mch_private_key)
@@ -89,5 +98,5 @@ def new_certificate_downloader(mch_id: str, mch_cert_serial_no: str, mch_private
     validator = NullValidateor()
 
     from .client import Client
-    client = Client(signer=signer, credential=credential, validator=validator)
-    return new_certificate_downloader_with_client(client=client, mch_api_v3_key=mch_api_v3_key)
+    client = Client(signer=signer, credential=credential, validator=validator, transport=transport)
+    return new_certificate_downloader_with_client(client=client, mch_api_v3_key=mch_api_v3_key, api_server=api_server)
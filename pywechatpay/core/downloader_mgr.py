@@ -1,4 +1,5 @@
 from .downloader import new_certificate_downloader
+from ..constants import WECHAT_PAY_API_SERVER
 
 
 class PseudoCertificateDownloader:
@@ -15,6 +16,10 @@ class PseudoCertificateDownloader:
         """
         return self.mgr.get_certificate(self.mch_id, serial_no)
 
+    def get_all(self) -> dict:
+        """获取所有平台证书, 证书序列号 -> 证书"""
+        return self.mgr.get_certificates(self.mch_id)
+
 
 class CertificateDownloaderMgr:
     """证书下载管理器"""
@@ -33,6 +38,15 @@ class CertificateDownloaderMgr:
         downloader = self.downloader_map[mch_id]
         return downloader.get(serial_no)
 
+    def get_certificates(self, mch_id: str) -> dict:
+        """
+        获取商户的所有平台证书
+
+        :param mch_id: 商户号
+        :return: 证书序列号 -> 证书
+        """
+        return self.downloader_map[mch_id].get_all()
+
     def get_certificate_visitor(self, mch_id: str):
         """
         获取某个商户的平台证书访问器
@@ -52,7 +66,8 @@ class CertificateDownloaderMgr:
         return mch_id in self.downloader_map
 
     def register_downloader_with_private_key(self, mch_id: str, mch_cert_serial_no: str, mch_private_key: str,
-                                             mch_api_v3_key: str):
+                                             mch_api_v3_key: str, api_server: str = WECHAT_PAY_API_SERVER,
+                                             transport=None):
         """
         注册商户的平台证书下载器
 
@@ -60,9 +75,12 @@ class CertificateDownloaderMgr:
         :param mch_cert_serial_no:
         :param mch_private_key:
         :param mch_api_v3_key:
+        :param api_server: 微信支付 API 地址
+        :param transport: HTTP 传输层, 不传则新建
         :return:
         """
-        downloader = new_certificate_downloader(mch_id, mch_cert_serial_no, mch_private_key, mch_api_v3_key)
+        downloader = new_certificate_downloader(mch_id, mch_cert_serial_no, mch_private_key, mch_api_v3_key,
+                                                api_server, transport=transport)
         self.downloader_map[mch_id] = downloader
 
 
@@ -1,5 +1,7 @@
 import json
 
+from requests.structures import CaseInsensitiveDict
+
 from .validator import WechatPayNotifyValidator, Validator
 from .verifier import Verifier
 from ..exceptions import WechatPayException
@@ -22,10 +24,11 @@ class Handler:
         """
         解析微信支付通知
 
-        :param headers: 请求头
+        :param headers: 请求头, 不区分大小写
         :param body: 请求主体
         :return:
         """
+        headers = CaseInsensitiveDict(headers)
         try:
             self.validator.validate(headers=headers, body=body)
         except Exception as ex:
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from requests.structures import CaseInsensitiveDict
+
+from .notify import Handler
+from ..utils.stats import percentile
+
+# 通知请求主体的最大长度
+MAX_BODY_SIZE = 1024 * 1024
+
+_FAIL_BODY = json.dumps({"code": "FAIL", "message": "系统繁忙"}).encode()
+
+
+class NotifyDispatcher:
+    """
+    通知分发器
+
+    收到的通知先放入有界队列, 由工作线程完成验签, 解密并调用回调. 队列满时拒绝新的通知,
+    由微信支付稍后重发, 以此实现背压
+
+    注意: 通知放入队列时就已经向微信支付返回成功, 之后验签, 解密或回调失败, 微信支付都不会再重发.
+    回调失败会在进程内重试 callback_retries 次, 仍然失败时交给 on_error, 应在 on_error 中持久化通知,
+    或通过查询订单接口补偿. 进程退出时队列中未处理的通知也会丢失
+    """
+
+    def __init__(self, handler: Handler, callback, workers: int = 4, max_queue_size: int = 1000, on_error=None,
+                 latency_window: int = 1024, callback_retries: int = 2, retry_backoff: float = 0.1):
+        """
+
+        :param handler: 通知处理器
+        :param callback: 回调, 参数为解密后的通知内容
+        :param workers: 工作线程数
+        :param max_queue_size: 队列最大长度
+        :param on_error: 验签, 解密出错或回调重试后仍出错时的回调, 参数为 (异常, 请求头, 请求主体)
+        :param latency_window: 统计延迟时保留的最近样本数
+        :param callback_retries: 回调出错时的重试次数
+        :param retry_backoff: 第一次重试前等待的秒数, 之后每次翻倍
+        """
+        self.handler = handler
+        self.callback = callback
+        self.workers = workers
+        self.on_error = on_error
+        self.callback_retries = callback_retries
+        self.retry_backoff = retry_backoff
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.retried = 0
+        # 按原因统计的失败数, parse 为验签或解密失败, callback 为回调重试后仍失败
+        self.failed = {"parse": 0, "callback": 0}
+        self.wait_latencies = deque(maxlen=latency_window)
+        self.process_latencies = deque(maxlen=latency_window)
+
+    def start(self):
+        """启动工作线程, 重复调用无副作用"""
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"pywechatpay-notify-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def stop(self, timeout: float = None):
+        """
+        处理完队列中的通知后停止工作线程
+
+        :param timeout: 每个线程的最长等待时间
+        :return:
+        """
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.queue.put(None)
+        for t in threads:
+            t.join(timeout)
+
+    def submit(self, headers, body: str) -> bool:
+        """
+        提交通知, 队列已满时返回 False
+
+        :param headers: 请求头
+        :param body: 请求主体
+        :return:
+        """
+        if not self.threads:
+            self.start()
+        try:
+            self.queue.put_nowait((CaseInsensitiveDict(headers), body, time.perf_counter()))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            headers, body, enqueued = item
+            start = time.perf_counter()
+            cause = None
+            try:
+                content = self.handler.parse_notify_request(headers=headers, body=body)
+            except Exception as ex:
+                cause, error = "parse", ex
+            else:
+                error = self._call_with_retry(content)
+                if error is not None:
+                    cause = "callback"
+            if cause and self.on_error:
+                try:
+                    self.on_error(error, headers, body)
+                except Exception:
+                    pass
+            end = time.perf_counter()
+            with self.lock:
+                if cause:
+                    self.failed[cause] += 1
+                else:
+                    self.processed += 1
+                self.wait_latencies.append(start - enqueued)
+                self.process_latencies.append(end - start)
+
+    def _call_with_retry(self, content):
+        """调用回调, 出错时按指数退避重试, 返回最后一次的异常, 成功时返回 None"""
+        for attempt in range(self.callback_retries + 1):
+            if attempt:
+                with self.lock:
+                    self.retried += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                self.callback(content)
+                return None
+            except Exception as ex:
+                error = ex
+        return error
+
+    def metrics(self) -> dict:
+        """队列深度, 计数和延迟统计, 延迟单位为毫秒"""
+        with self.lock:
+            wait = sorted(v * 1000 for v in self.wait_latencies)
+            process = sorted(v * 1000 for v in self.process_latencies)
+            data = {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_size": self.queue.maxsize,
+                "workers": len(self.threads),
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "retried": self.retried,
+                "failed": dict(self.failed),
+            }
+        for name, values in (("queue_wait_ms", wait), ("processing_ms", process)):
+            data[name] = {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else 0.0,
+            }
+        return data
+
+
+class NotifyASGIApp:
+    """
+    接收微信支付通知的 ASGI 应用
+
+    POST 通知放入 NotifyDispatcher 后立即返回 204, 此时还没有验签和处理, 见 NotifyDispatcher 的说明.
+    队列已满时返回 503, 请求主体为空或不是 UTF-8 时返回 400; GET metrics_path 返回统计数据
+    """
+
+    def __init__(self, dispatcher: NotifyDispatcher, metrics_path: str = "/metrics"):
+        self.dispatcher = dispatcher
+        self.metrics_path = metrics_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        method = scope["method"]
+        if method == "GET" and self.metrics_path and scope["path"] == self.metrics_path:
+            return await self._reply(send, 200, json.dumps(self.dispatcher.metrics()).encode())
+        if method != "POST":
+            return await self._reply(send, 405, b"")
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                return await self._reply(send, 413, b"")
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        if not size:
+            return await self._reply(send, 400, b"")
+        try:
+            body = b"".join(chunks).decode()
+        except UnicodeDecodeError:
+            return await self._reply(send, 400, b"")
+        if self.dispatcher.submit(headers, body):
+            return await self._reply(send, 204, b"")
+        return await self._reply(send, 503, _FAIL_BODY)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.dispatcher.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.dispatcher.stop)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _reply(send, status: int, body: bytes):
+        headers = [(b"content-type", b"application/json")] if body else []
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class NotifyWSGIApp:
+    """
+    接收微信支付通知的 WSGI 应用
+
+    POST 通知放入 NotifyDispatcher 后立即返回 204, 此时还没有验签和处理, 见 NotifyDispatcher 的说明.
+    队列已满时返回 503, 请求主体为空或不是 UTF-8 时返回 400. 没有 Content-Length 时, 服务器设置了
+    wsgi.input_terminated 则读到 EOF, 否则返回 411; GET metrics_path 返回统计数据
+    """
+
+    def __init__(self, dispatcher: NotifyDispatcher, metrics_path: str = "/metrics"):
+        self.dispatcher = dispatcher
+        self.metrics_path = metrics_path
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        if method == "GET" and self.metrics_path and environ.get("PATH_INFO") == self.metrics_path:
+            return self._reply(start_response, "200 OK", json.dumps(self.dispatcher.metrics()).encode())
+        if method != "POST":
+            return self._reply(start_response, "405 Method Not Allowed", b"")
+
+        content_length = environ.get("CONTENT_LENGTH")
+        if content_length:
+            try:
+                length = int(content_length)
+            except ValueError:
+                return self._reply(start_response, "400 Bad Request", b"")
+            if length > MAX_BODY_SIZE:
+                return self._reply(start_response, "413 Payload Too Large", b"")
+            data = environ["wsgi.input"].read(length)
+        elif environ.get("wsgi.input_terminated"):
+            # 分块传输等没有 Content-Length 的请求, 服务器保证 wsgi.input 在主体结束处返回 EOF
+            data = environ["wsgi.input"].read(MAX_BODY_SIZE + 1)
+            if len(data) > MAX_BODY_SIZE:
+                return self._reply(start_response, "413 Payload Too Large", b"")
+        else:
+            return self._reply(start_response, "411 Length Required", b"")
+        if not data:
+            return self._reply(start_response, "400 Bad Request", b"")
+        try:
+            body = data.decode()
+        except UnicodeDecodeError:
+            return self._reply(start_response, "400 Bad Request", b"")
+
+        headers = {k[5:].replace("_", "-"): v for k, v in environ.items() if k.startswith("HTTP_")}
+        if "CONTENT_TYPE" in environ:
+            headers["Content-Type"] = environ["CONTENT_TYPE"]
+        if self.dispatcher.submit(headers, body):
+            return self._reply(start_response, "204 No Content", b"")
+        return self._reply(start_response, "503 Service Unavailable", _FAIL_BODY)
+
+    @staticmethod
+    def _reply(start_response, status: str, body: bytes):
+        headers = [("Content-Length", str(len(body)))]
+        if body:
+            headers.append(("Content-Type", "application/json"))
+        start_response(status, headers)
+        return [body]
+
+
+def new_notify_asgi_app(handler: Handler, callback, **kwargs) -> NotifyASGIApp:
+    """
+    创建接收通知的 ASGI 应用
+
+    :param handler: 通知处理器
+    :param callback: 回调, 参数为解密后的通知内容
+    :param kwargs: NotifyDispatcher 的其他参数
+    :return:
+    """
+    return NotifyASGIApp(NotifyDispatcher(handler, callback, **kwargs))
+
+
+def new_notify_wsgi_app(handler: Handler, callback, **kwargs) -> NotifyWSGIApp:
+    """
+    创建接收通知的 WSGI 应用
+
+    :param handler: 通知处理器
+    :param callback: 回调, 参数为解密后的通知内容
+    :param kwargs: NotifyDispatcher 的其他参数
+    :return:
+    """
+    return NotifyWSGIApp(NotifyDispatcher(handler, callback, **kwargs))
@@ -0,0 +1,139 @@
+import contextlib
+import contextvars
+import re
+import threading
+import time
+from collections import deque
+
+from ..constants import DEFAULT_CONNECT_TIMEOUT, DEFAULT_TIMEOUT
+from ..utils.stats import percentile
+
+_deadline = contextvars.ContextVar("pywechatpay_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """
+    为代码块内的所有请求(包括重试)设置总的截止时间, 嵌套时取较早的截止时间.
+    每次尝试的连接超时与读取超时之和不超过剩余时间, 应答在截止时间之后才收完时同样抛出 WechatPayTimeoutException.
+    用法: with deadline(2): svc.pay_transactions_out_trade_no(...)
+
+    :param seconds: 从现在起的秒数
+    :return:
+    """
+    value = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        value = min(value, current)
+    token = _deadline.set(value)
+    try:
+        yield value
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline():
+    """当前上下文的截止时间, time.monotonic() 格式, 没有则返回 None"""
+    return _deadline.get()
+
+
+class _TimeoutRule:
+    __slots__ = ("pattern", "method", "connect", "read", "latencies")
+
+    def __init__(self, pattern: str, method: str, connect: float, read: float, window: int):
+        self.pattern = re.compile(pattern)
+        self.method = method.upper() if method else None
+        self.connect = connect
+        self.read = read
+        self.latencies = deque(maxlen=window)
+
+    def match(self, method: str, path: str) -> bool:
+        return (self.method is None or self.method == method) and self.pattern.search(path) is not None
+
+
+class TimeoutPolicy:
+    """
+    超时策略, 按接口路径分别设置连接超时和读取超时
+
+    规则按添加顺序匹配请求路径, 都不匹配时使用默认超时. 开启自适应后, 每个规则的读取超时取该规则最近请求耗时的
+    分位数乘以 multiplier, 并限制在 [min_read_timeout, 规则的读取超时] 之间, 样本数不足 min_samples 时使用规则的读取超时.
+    连接超时不参与自适应, 始终使用规则的连接超时: 请求耗时中无法区分建立连接的时间, 而且复用连接时没有建立连接的过程
+    """
+
+    def __init__(self, connect: float = DEFAULT_CONNECT_TIMEOUT, read: float = DEFAULT_TIMEOUT,
+                 adaptive: bool = False, latency_percentile: float = 99, multiplier: float = 2,
+                 min_read_timeout: float = 1, window: int = 256, min_samples: int = 20):
+        """
+
+        :param connect: 默认连接超时, 单位秒
+        :param read: 默认读取超时, 单位秒
+        :param adaptive: 是否根据观测到的耗时调整读取超时, 连接超时不调整
+        :param latency_percentile: 自适应时使用的耗时分位数
+        :param multiplier: 自适应时在分位数上乘的系数
+        :param min_read_timeout: 自适应时读取超时的下限
+        :param window: 每个规则保留的最近耗时样本数
+        :param min_samples: 开始自适应需要的最少样本数
+        """
+        self.adaptive = adaptive
+        self.latency_percentile = latency_percentile
+        self.multiplier = multiplier
+        self.min_read_timeout = min_read_timeout
+        self.window = window
+        self.min_samples = min_samples
+
+        self.rules = []
+        self.default = _TimeoutRule("", None, connect, read, window)
+        self.lock = threading.Lock()
+
+    def add_rule(self, pattern: str, connect: float, read: float, method: str = None):
+        """
+        添加超时规则
+
+        :param pattern: 匹配请求路径的正则表达式, 如 r"^/v3/pay/transactions/out-trade-no/"
+        :param connect: 连接超时, 单位秒
+        :param read: 读取超时, 单位秒
+        :param method: 请求方法, 不传则匹配所有方法
+        :return:
+        """
+        self.rules.append(_TimeoutRule(pattern, method, connect, read, self.window))
+        return self
+
+    def _match(self, method: str, path: str) -> _TimeoutRule:
+        method = method.upper()
+        for rule in self.rules:
+            if rule.match(method, path):
+                return rule
+        return self.default
+
+    def get_timeout(self, method: str, path: str) -> tuple:
+        """
+        获取请求的 (连接超时, 读取超时)
+
+        :param method: 请求方法
+        :param path: 请求路径
+        :return:
+        """
+        rule = self._match(method, path)
+        read = rule.read
+        if self.adaptive:
+            with self.lock:
+                samples = sorted(rule.latencies) if len(rule.latencies) >= self.min_samples else None
+            if samples:
+                adaptive_read = percentile(samples, self.latency_percentile) * self.multiplier
+                read = min(rule.read, max(self.min_read_timeout, adaptive_read))
+        return rule.connect, read
+
+    def observe(self, method: str, path: str, elapsed: float):
+        """
+        记录请求耗时
+
+        :param method: 请求方法
+        :param path: 请求路径
+        :param elapsed: 耗时, 单位秒
+        :return:
+        """
+        if not self.adaptive:
+            return
+        rule = self._match(method, path)
+        with self.lock:
+            rule.latencies.append(elapsed)
@@ -0,0 +1,241 @@
+import abc
+import json as _json
+import threading
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from ..constants import VERSION, USER_AGENT_FORMAT
+
+
+class HttpResponse:
+    """传输层返回的应答, 与 requests.Response 的常用属性一致"""
+
+    def __init__(self, status_code: int, headers, content: bytes, raw=None):
+        """
+
+        :param status_code: 状态码
+        :param headers: 应答头, 不区分大小写
+        :param content: 应答主体
+        :param raw: 底层库的原始应答
+        """
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.raw = raw
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self, **kwargs):
+        return _json.loads(self.content, **kwargs)
+
+
+class Transport(metaclass=abc.ABCMeta):
+    """HTTP 传输层"""
+
+    # 可以重试的异常, 即连接失败和超时
+    retryable_exceptions = ()
+    # 超时异常
+    timeout_exceptions = ()
+    # 属于 timeout_exceptions 的子类, 但实际不是超时的异常
+    non_timeout_exceptions = ()
+
+    @abc.abstractmethod
+    def request(self, method: str, url: str, headers: dict, body: bytes = None, timeout=None, **kwargs):
+        """
+        发送请求, 返回具有 status_code, headers, content, text, json() 的应答
+
+        :param method: 请求方法
+        :param url: 请求地址, 包含查询串
+        :param headers: 请求头
+        :param body: 请求主体
+        :param timeout: 超时时间, 秒数或 (连接超时, 读取超时)
+        :param kwargs: 底层库支持的其他参数
+        :return:
+        """
+
+    def is_timeout(self, ex: Exception) -> bool:
+        """异常是否为超时, 连接被拒绝等立即失败的异常不算"""
+        return isinstance(ex, self.timeout_exceptions) and not isinstance(ex, self.non_timeout_exceptions)
+
+    def pool_size(self, url: str):
+        """
+        连接池为 url 所在 host 保留的最大连接数, 未知时返回 None
+
+        :param url: 请求地址
+        :return:
+        """
+        return None
+
+    def warm_up(self, url: str, connections: int, timeout: float = 5) -> int:
+        """
+        同时发起 connections 个请求, 预先建立连接(包括 TLS 握手)并放回连接池, 返回成功的请求数.
+        connections 超过连接池大小时按连接池大小计算, 多出的连接放不回连接池. 不关心应答的状态码
+
+        :param url: 请求地址
+        :param connections: 连接数
+        :param timeout: 超时时间
+        :return:
+        """
+        pool_size = self.pool_size(url)
+        if pool_size is not None:
+            connections = min(connections, pool_size)
+        if connections <= 0:
+            return 0
+        barrier = threading.Barrier(connections)
+        opened = []
+
+        def open_connection():
+            try:
+                barrier.wait(timeout)
+            except threading.BrokenBarrierError:
+                pass
+            try:
+                self.request("HEAD", url, {"User-Agent": USER_AGENT_FORMAT % VERSION}, timeout=timeout)
+            except Exception:
+                return
+            opened.append(1)
+
+        threads = [threading.Thread(target=open_connection) for _ in range(connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return len(opened)
+
+    def close(self):
+        """关闭连接池"""
+
+
+class RequestsTransport(Transport):
+    """基于 requests 的传输层, 直接返回 requests.Response"""
+
+    retryable_exceptions = (requests.ConnectionError, requests.Timeout)
+    timeout_exceptions = (requests.Timeout,)
+
+    def __init__(self, session: requests.Session = None, pool_connections: int = 10, pool_maxsize: int = 10):
+        """
+
+        :param session: requests 会话, 不传则新建
+        :param pool_connections: 新建会话时, 连接池缓存的 host 数量
+        :param pool_maxsize: 新建会话时, 每个 host 的最大连接数
+        """
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def request(self, method, url, headers, body=None, timeout=None, **kwargs):
+        return self.session.request(method, url, data=body, headers=headers, timeout=timeout, **kwargs)
+
+    def pool_size(self, url):
+        return getattr(self.session.get_adapter(url), "_pool_maxsize", None)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """直接使用 urllib3 连接池的传输层, 省去 requests 的会话和适配器开销"""
+
+    retryable_exceptions = (urllib3.exceptions.TimeoutError, urllib3.exceptions.ProtocolError,
+                            urllib3.exceptions.NewConnectionError, urllib3.exceptions.MaxRetryError)
+    timeout_exceptions = (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ConnectTimeoutError)
+    # urllib3 2.x 中 NewConnectionError 是 ConnectTimeoutError 的子类, 但连接被拒绝时也会抛出
+    non_timeout_exceptions = (urllib3.exceptions.NewConnectionError,)
+
+    def __init__(self, pool_manager: urllib3.PoolManager = None, num_pools: int = 10, maxsize: int = 10,
+                 block: bool = False):
+        """
+
+        :param pool_manager: urllib3 连接池管理器, 不传则新建
+        :param num_pools: 新建时缓存的 host 数量
+        :param maxsize: 新建时每个 host 的最大连接数
+        :param block: 新建时连接用完后是否等待, 而不是新建连接
+        """
+        self.pool_manager = pool_manager or urllib3.PoolManager(num_pools=num_pools, maxsize=maxsize, block=block)
+
+    def request(self, method, url, headers, body=None, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):
+            timeout = urllib3.Timeout(connect=timeout[0], read=timeout[1])
+        response = self.pool_manager.request(method.upper(), url, body=body, headers=headers, timeout=timeout,
+                                             retries=False, redirect=False, **kwargs)
+        return HttpResponse(response.status, response.headers, response.data, raw=response)
+
+    def pool_size(self, url):
+        return self.pool_manager.connection_pool_kw.get("maxsize", 1)
+
+    def close(self):
+        self.pool_manager.clear()
+
+
+class HttpxTransport(Transport):
+    """
+    基于 httpx 的传输层, 默认开启 HTTP/2, 多个并发请求复用同一个连接, 预热时也只需要建立一个连接.
+    需要安装 httpx, 开启 HTTP/2 还需要 h2: pip install httpx[http2]
+    """
+
+    def __init__(self, client=None, http2: bool = True, max_connections: int = 100,
+                 max_keepalive_connections: int = 20):
+        """
+
+        :param client: httpx.Client, 不传则新建
+        :param http2: 新建时是否开启 HTTP/2
+        :param max_connections: 新建时的最大连接数
+        :param max_keepalive_connections: 新建时保持的空闲连接数
+        """
+        import httpx
+
+        self.httpx = httpx
+        self.retryable_exceptions = (httpx.TransportError,)
+        self.timeout_exceptions = (httpx.TimeoutException,)
+        # 传入 client 时无法得知连接池大小
+        self.http2 = http2 if client is None else None
+        self.max_keepalive_connections = max_keepalive_connections if client is None else None
+        self.client = client or httpx.Client(http2=http2, limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive_connections))
+
+    def request(self, method, url, headers, body=None, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = self.httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+        return self.client.request(method.upper(), url, content=body, headers=headers, timeout=timeout, **kwargs)
+
+    def pool_size(self, url):
+        if self.max_keepalive_connections is None:
+            return None
+        # httpx 只在 https 上协商 HTTP/2, 此时并发请求复用同一个连接
+        if self.http2 and url.startswith("https://"):
+            return 1
+        return self.max_keepalive_connections
+
+    def close(self):
+        self.client.close()
+
+
+TRANSPORTS = {
+    "requests": RequestsTransport,
+    "urllib3": Urllib3Transport,
+    "httpx": HttpxTransport,
+}
+
+
+def new_transport(name: str, **kwargs) -> Transport:
+    """
+    按名称创建传输层
+
+    :param name: requests, urllib3 或 httpx
+    :param kwargs: 传输层的参数
+    :return:
+    """
+    try:
+        transport_class = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(f"unknown transport {name!r}, choose from {', '.join(TRANSPORTS)}")
+    return transport_class(**kwargs)
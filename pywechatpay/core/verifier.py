@@ -1,6 +1,7 @@
 import abc
 from base64 import b64decode
 
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
 from cryptography.hazmat.primitives.hashes import SHA256
 
@@ -27,16 +28,59 @@ class SHA256WithRSAVerifier(Verifier):
 
     def __init__(self, cert_getter):
         self.cert_getter = cert_getter
+        # 证书序列号 -> (证书, 公钥), 证书更新后重新获取公钥
+        self.public_keys = {}
+
+    def get_public_key(self, serial_no: str):
+        """
+        获取证书序列号对应的公钥, 证书不存在时返回 None
+
+        :param serial_no: 证书序列号
+        :return:
+        """
+        certificate = self.cert_getter.get(serial_no)
+        if not certificate:
+            return None
+        cached = self.public_keys.get(serial_no)
+        if cached is not None and cached[0] is certificate:
+            return cached[1]
+        public_key = certificate.public_key()
+        self.public_keys[serial_no] = (certificate, public_key)
+        return public_key
+
+    def warm_up(self) -> int:
+        """
+        载入所有已知平台证书的公钥, 并各做一次验签, 返回载入的公钥数
+
+        :return:
+        """
+        if isinstance(self.cert_getter, dict):
+            serials = list(self.cert_getter.keys())
+        elif hasattr(self.cert_getter, "get_all"):
+            serials = list(self.cert_getter.get_all().keys())
+        else:
+            serials = []
+
+        count = 0
+        for serial_no in serials:
+            public_key = self.get_public_key(serial_no)
+            if public_key is None:
+                continue
+            # 签名必然不匹配, 只为完成公钥的首次运算准备
+            try:
+                public_key.verify(bytes(public_key.key_size // 8), b"warm-up", PKCS1v15(), SHA256())
+            except InvalidSignature:
+                pass
+            count += 1
+        return count
 
     def verify(self, serial_no, message, signature):
         message_bytes = str.encode(message)
         signature = b64decode(signature)
-        certificate = self.cert_getter.get(serial_no)
-        if not certificate:
+        public_key = self.get_public_key(serial_no)
+        if public_key is None:
             raise WechatPayException(f"certificate[{serial_no}] not found in verifier")
 
-        public_key = certificate.public_key()
-
         try:
             public_key.verify(signature, message_bytes, PKCS1v15(), SHA256())
         except Exception as ex:
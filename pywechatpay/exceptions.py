@@ -3,4 +3,14 @@ class WechatPayException(Exception):
 
 
 class WechatPayAPIException(Exception):
+    """接口返回非 2xx 应答, status_code 为状态码, code 为应答中的错误码"""
+
+    def __init__(self, message, status_code: int = None, code: str = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class WechatPayTimeoutException(WechatPayException):
+    """请求超过截止时间"""
     pass
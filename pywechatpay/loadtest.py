@@ -0,0 +1,531 @@
+"""
+压测工具, 按指定的接口比例和并发/速率请求微信支付接口, 统计吞吐量和延迟分位数
+
+用法示例::
+
+    # 启动本地模拟服务并压测
+    python -m pywechatpay.loadtest --mock --mix query=8,create=2 --concurrency 16 --duration 30
+
+    # 压测指定地址, 以 asyncio 方式按 200 RPS 发起请求, 输出 JSON
+    python -m pywechatpay.loadtest --base-url http://127.0.0.1:8000 --mch-id xxx --mch-cert-serial-no xxx \\
+        --mch-private-key key.pem --mch-api-v3-key xxx --mode asyncio --rate 200 --format json
+
+    # 对比各个传输层的吞吐量, 延迟和内存
+    python -m pywechatpay.loadtest --mock --compare-transports requests,urllib3,httpx --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import WECHAT_PAY_API_SERVER
+from .core.client import with_wechat_pay_auto_auth_cipher_using_downloader_mgr
+from .core.downloader_mgr import CertificateDownloaderMgr
+from .core.transport import TRANSPORTS, new_transport
+from .services.payments.app import AppApiService
+from .utils.stats import percentile
+
+ENDPOINTS = ("query", "create", "certificates")
+MODES = ("threads", "processes", "asyncio")
+PHASES = ("total", "sign", "network", "verify")
+
+Sample = namedtuple("Sample", ["endpoint", "error", "total", "sign", "network", "verify"])
+
+LoadConfig = namedtuple("LoadConfig", ["base_url", "mch_id", "mch_cert_serial_no", "mch_private_key", "mch_api_v3_key",
+                                       "appid", "notify_url", "mix", "query_out_trade_no", "transport",
+                                       "pool_size", "warm_up"])
+
+_phase = threading.local()
+
+
+class _TimedCredential:
+    """记录签名耗时的认证器"""
+
+    def __init__(self, credential):
+        self.credential = credential
+
+    def gen_authorization_header(self, method: str, url: str, body: str) -> str:
+        start = time.perf_counter()
+        try:
+            return self.credential.gen_authorization_header(method, url, body)
+        finally:
+            _phase.sign = time.perf_counter() - start
+
+
+class _TimedValidator:
+    """记录验签耗时的验证器"""
+
+    def __init__(self, validator):
+        self.validator = validator
+
+    @property
+    def verifier(self):
+        # Client.warm_up 通过 validator.verifier 载入平台证书公钥
+        return getattr(self.validator, "verifier", None)
+
+    def validate(self, headers, body):
+        start = time.perf_counter()
+        try:
+            return self.validator.validate(headers, body)
+        finally:
+            _phase.verify = time.perf_counter() - start
+
+
+class LoadContext:
+    """单个进程内的压测上下文, 持有 client 和接口服务"""
+
+    def __init__(self, config: LoadConfig):
+        self.config = config
+
+        mgr = CertificateDownloaderMgr()
+        mgr.register_downloader_with_private_key(config.mch_id, config.mch_cert_serial_no, config.mch_private_key,
+                                                 config.mch_api_v3_key, api_server=config.base_url)
+        self.client = with_wechat_pay_auto_auth_cipher_using_downloader_mgr(config.mch_id, config.mch_cert_serial_no,
+                                                                           config.mch_private_key, mgr,
+                                                                           transport=_new_transport(config))
+        self.client.credential = _TimedCredential(self.client.credential)
+        self.client.validator = _TimedValidator(self.client.validator)
+        self.svc = AppApiService(self.client, api_server=config.base_url)
+
+        self.endpoints = list(config.mix.keys())
+        self.weights = list(config.mix.values())
+        self.counter = itertools.count()
+        self.prefix = "lt%d%d" % (os.getpid(), int(time.time()))
+
+        self.query_out_trade_no = config.query_out_trade_no
+        if "query" in config.mix and not self.query_out_trade_no:
+            self.query_out_trade_no = self.gen_out_trade_no()
+            self.create(self.query_out_trade_no)
+
+        self.warm_up_report = None
+        if config.warm_up:
+            self.warm_up_report = self.client.warm_up(connections=config.pool_size, api_server=config.base_url)
+
+    def choose(self, rnd: random.Random) -> str:
+        return rnd.choices(self.endpoints, self.weights)[0]
+
+    def gen_out_trade_no(self) -> str:
+        return "%s%d" % (self.prefix, next(self.counter))
+
+    def create(self, out_trade_no: str):
+        return self.svc.pay_transactions_app(appid=self.config.appid, mchid=self.config.mch_id,
+                                             description="loadtest", out_trade_no=out_trade_no, total=1,
+                                             notify_url=self.config.notify_url)
+
+    def call(self, endpoint: str) -> Sample:
+        """
+        请求一次接口并返回各阶段耗时
+
+        :param endpoint: 接口名称
+        :return:
+        """
+        _phase.sign = _phase.verify = 0.0
+        error = None
+        start = time.perf_counter()
+        try:
+            if endpoint == "query":
+                self.svc.pay_transactions_out_trade_no(self.config.mch_id, self.query_out_trade_no)
+            elif endpoint == "create":
+                self.create(self.gen_out_trade_no())
+            else:
+                self.client.request("get", self.config.base_url + "/v3/certificates")
+        except Exception as ex:
+            error = type(ex).__name__
+        total = time.perf_counter() - start
+        sign, verify = _phase.sign, _phase.verify
+        return Sample(endpoint, error, total, sign, max(total - sign - verify, 0.0), verify)
+
+
+def _new_transport(config: LoadConfig):
+    # 各个传输层的连接池参数名不同, 统一按并发数设置
+    size = config.pool_size
+    if config.transport == "requests":
+        return new_transport("requests", pool_maxsize=size)
+    if config.transport == "urllib3":
+        return new_transport("urllib3", maxsize=size)
+    return new_transport(config.transport, max_connections=size, max_keepalive_connections=size)
+
+
+class _Pacer:
+    """按目标速率分配请求的发起时间, 速率为 0 时不限速"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            slot = max(self.next_time, time.perf_counter())
+            self.next_time = slot + self.interval
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _run_threads(ctx: LoadContext, concurrency: int, rate: float, duration: float) -> list:
+    pacer = _Pacer(rate)
+    deadline = time.perf_counter() + duration
+    results = []
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        samples = []
+        while True:
+            pacer.wait()
+            if time.perf_counter() >= deadline:
+                break
+            samples.append(ctx.call(ctx.choose(rnd)))
+        results.append(samples)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [s for samples in results for s in samples]
+
+
+def _process_worker(config, concurrency, rate, duration, ready, go, queue):
+    try:
+        ctx = LoadContext(config)
+    except Exception as ex:
+        ctx = RuntimeError(f"worker setup failed: {ex!r}")
+    ready.wait()
+    go.wait()
+    if not isinstance(ctx, LoadContext):
+        return queue.put(ctx)
+    start = time.perf_counter()
+    samples = _run_threads(ctx, concurrency, rate, duration)
+    queue.put((samples, time.perf_counter() - start))
+
+
+def _split_concurrency(concurrency: int, processes: int) -> list:
+    """把并发数分给各进程, 进程数不超过并发数, 余数分给前面的进程"""
+    processes = max(min(processes, concurrency), 1)
+    return [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+
+
+def _run_processes(config: LoadConfig, processes: int, concurrency: int, rate: float, duration: float,
+                   on_ready=None) -> tuple:
+    """
+    多进程方式, 每个进程各自创建 client 并以多线程发起请求. 所有进程准备好后再同时开始.
+    进程数不超过并发数, 并发数和速率按比例分给各进程. 返回 (样本, 耗时), 耗时从同时开始算起,
+    不包括进程启动和创建 client 的时间
+
+    :param on_ready: 所有进程准备好后, 开始压测前的回调
+    """
+    shares = _split_concurrency(concurrency, processes)
+    processes = len(shares)
+    ready = multiprocessing.Barrier(processes + 1)
+    go = multiprocessing.Barrier(processes + 1)
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_process_worker,
+                                       args=(config, share, rate * share / concurrency if rate else 0, duration,
+                                             ready, go, queue))
+               for share in shares]
+    for w in workers:
+        w.start()
+    ready.wait()
+    if on_ready:
+        on_ready()
+    go.wait()
+    results = [queue.get() for _ in workers]
+    for w in workers:
+        w.join()
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return [s for samples, _ in results for s in samples], max(elapsed for _, elapsed in results)
+
+
+def _run_asyncio(ctx: LoadContext, concurrency: int, rate: float, duration: float) -> list:
+    """
+    asyncio 方式. 指定速率时按固定节奏发起请求, 不等待前面的请求完成(开环), 由 concurrency 限制同时进行的请求数;
+    不指定速率时, concurrency 个协程各自循环请求(闭环). 同步的 client 在线程池中执行
+    """
+    samples = []
+    rnd = random.Random(0)
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        executor = ThreadPoolExecutor(concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        deadline = loop.time() + duration
+
+        async def one(endpoint):
+            async with semaphore:
+                samples.append(await loop.run_in_executor(executor, ctx.call, endpoint))
+
+        async def closed_loop():
+            while loop.time() < deadline:
+                samples.append(await loop.run_in_executor(executor, ctx.call, ctx.choose(rnd)))
+
+        try:
+            if rate:
+                tasks = []
+                next_time = loop.time()
+                while next_time < deadline:
+                    tasks.append(asyncio.ensure_future(one(ctx.choose(rnd))))
+                    next_time += 1.0 / rate
+                    await asyncio.sleep(max(next_time - loop.time(), 0))
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.gather(*[closed_loop() for _ in range(concurrency)])
+        finally:
+            executor.shutdown(wait=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+    return samples
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """
+    汇总压测结果, 延迟单位为毫秒
+
+    :param samples: 请求样本
+    :param elapsed: 压测耗时, 单位秒
+    :return:
+    """
+    errors = Counter(s.error for s in samples if s.error)
+    ok = [s for s in samples if not s.error]
+    latency = {}
+    for phase in PHASES:
+        values = sorted(getattr(s, phase) * 1000 for s in ok)
+        latency[phase] = {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
+    return {
+        "elapsed": elapsed,
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "error_types": dict(errors),
+        "endpoints": dict(Counter(s.endpoint for s in samples)),
+        "latency_ms": latency,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        "requests: %d  errors: %d  elapsed: %.2fs  rps: %.1f" % (report["requests"], report["errors"],
+                                                                 report["elapsed"], report["rps"]),
+        "endpoints: " + ", ".join("%s=%d" % kv for kv in sorted(report["endpoints"].items())),
+    ]
+    if report["error_types"]:
+        lines.append("error types: " + ", ".join("%s=%d" % kv for kv in sorted(report["error_types"].items())))
+    lines.append("%-8s %10s %10s %10s %10s" % ("phase(ms)", "p50", "p95", "p99", "max"))
+    for phase in PHASES:
+        stat = report["latency_ms"][phase]
+        lines.append("%-9s %10.2f %10.2f %10.2f %10.2f" % (phase, stat["p50"], stat["p95"], stat["p99"], stat["max"]))
+    return "\n".join(lines)
+
+
+def parse_mix(text: str) -> dict:
+    """
+    解析接口比例, 如 "query=8,create=2"
+
+    :param text: 接口比例
+    :return:
+    """
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("at least one endpoint needs a positive weight")
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m pywechatpay.loadtest",
+                                     description="Load test WechatPay V3 API with the pywechatpay client.")
+    parser.add_argument("--base-url", default=WECHAT_PAY_API_SERVER, help="API server, default %(default)s")
+    parser.add_argument("--mock", action="store_true",
+                        help="start a local MockWechatPayServer and test against it, merchant options are ignored")
+    parser.add_argument("--mock-latency", type=float, default=0, help="mock server latency in seconds")
+    parser.add_argument("--mock-error-rate", type=float, default=0, help="mock server error rate, 0 to 1")
+    parser.add_argument("--mch-id")
+    parser.add_argument("--mch-cert-serial-no")
+    parser.add_argument("--mch-private-key", help="path of the merchant private key PEM file")
+    parser.add_argument("--mch-api-v3-key")
+    parser.add_argument("--appid", default="wxloadtest")
+    parser.add_argument("--notify-url", default="https://example.com/notify")
+    parser.add_argument("--query-out-trade-no", help="order to query, by default one is created before the test")
+    parser.add_argument("--mix", type=parse_mix, default="query=1", help="endpoint weights, e.g. query=8,create=2")
+    parser.add_argument("--mode", choices=MODES, default="threads")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests, default %(default)s")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="worker processes in processes mode, at most --concurrency, default %(default)s")
+    parser.add_argument("--rate", type=float, default=0, help="target requests per second, 0 means unlimited")
+    parser.add_argument("--duration", type=float, default=10, help="seconds, default %(default)s")
+    parser.add_argument("--warm-up", action="store_true", help="call Client.warm_up before the test starts")
+    parser.add_argument("--transport", choices=list(TRANSPORTS), default="requests", help="default %(default)s")
+    parser.add_argument("--compare-transports", metavar="NAMES",
+                        help="run the test once per transport, each in a fresh process, e.g. requests,urllib3,httpx")
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    return parser
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的单位是 KB, macOS 是字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _compare_worker(config, mode, concurrency, rate, duration, ready, go, queue):
+    try:
+        ctx = LoadContext(config)
+    except Exception as ex:
+        ctx = RuntimeError(f"{config.transport} setup failed: {ex!r}")
+    ready.wait()
+    go.wait()
+    if not isinstance(ctx, LoadContext):
+        return queue.put(ctx)
+    start = time.perf_counter()
+    if mode == "asyncio":
+        samples = _run_asyncio(ctx, concurrency, rate, duration)
+    else:
+        samples = _run_threads(ctx, concurrency, rate, duration)
+    report = summarize(samples, time.perf_counter() - start)
+    report["peak_rss_mb"] = _peak_rss_mb()
+    queue.put(report)
+
+
+def _compare_transports(config: LoadConfig, names: list, mode: str, concurrency: int, rate: float, duration: float,
+                        on_ready=None) -> dict:
+    """
+    依次在新的进程中用每个传输层压测, 返回各自的报告. 进程使用 spawn 方式启动, 内存统计不受父进程影响
+
+    :param on_ready: 每个进程准备好后, 开始压测前的回调
+    """
+    mp = multiprocessing.get_context("spawn")
+    reports = {}
+    for name in names:
+        ready, go, queue = mp.Barrier(2), mp.Barrier(2), mp.Queue()
+        worker = mp.Process(target=_compare_worker, args=(config._replace(transport=name), mode, concurrency, rate,
+                                                          duration, ready, go, queue))
+        worker.start()
+        ready.wait()
+        if on_ready:
+            on_ready()
+        go.wait()
+        result = queue.get()
+        worker.join()
+        reports[name] = {"error": str(result)} if isinstance(result, Exception) else result
+    return reports
+
+
+def format_comparison(reports: dict) -> str:
+    lines = ["%-10s %10s %8s %10s %10s %10s %12s" % ("transport", "rps", "errors", "p50(ms)", "p99(ms)", "max(ms)",
+                                                     "peak_rss(MB)")]
+    for name, report in reports.items():
+        if "error" in report:
+            lines.append("%-10s %s" % (name, report["error"]))
+            continue
+        total = report["latency_ms"]["total"]
+        rss = report["peak_rss_mb"]
+        lines.append("%-10s %10.1f %8d %10.2f %10.2f %10.2f %12s" % (name, report["rps"], report["errors"],
+                                                                   total["p50"], total["p99"], total["max"],
+                                                                   "-" if rss is None else "%.1f" % rss))
+    return "\n".join(lines)
+
+
+def _start_mock(args):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    from .mock.server import MockWechatPayServer
+    from .utils.nonce import gen_noncestr
+
+    api_v3_key = gen_noncestr(32)
+    # 错误率在 client 完成证书下载后再打开
+    mock = MockWechatPayServer(api_v3_key, latency=args.mock_latency)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode().strip()
+    mock.add_merchant("1900000001", "LOADTEST", private_key.public_key())
+    mock.start()
+    return mock, ("1900000001", "LOADTEST", pem, api_v3_key)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    mock = None
+    if args.mock:
+        mock, merchant = _start_mock(args)
+        base_url = mock.base_url
+    else:
+        if not (args.mch_id and args.mch_cert_serial_no and args.mch_private_key and args.mch_api_v3_key):
+            print("--mch-id, --mch-cert-serial-no, --mch-private-key and --mch-api-v3-key are required without --mock",
+                  file=sys.stderr)
+            return 2
+        with open(args.mch_private_key, "r", encoding="utf8") as f:
+            merchant = (args.mch_id, args.mch_cert_serial_no, f.read().strip(), args.mch_api_v3_key)
+        base_url = args.base_url.rstrip("/")
+
+    def on_ready():
+        if mock:
+            mock.error_rate = args.mock_error_rate
+
+    config = LoadConfig(base_url, *merchant, args.appid, args.notify_url, args.mix, args.query_out_trade_no,
+                        args.transport, args.concurrency, args.warm_up)
+    try:
+        if args.compare_transports:
+            names = [name.strip() for name in args.compare_transports.split(",") if name.strip()]
+            unknown = [name for name in names if name not in TRANSPORTS]
+            if unknown:
+                print(f"unknown transports: {', '.join(unknown)}", file=sys.stderr)
+                return 2
+            reports = _compare_transports(config, names, args.mode, args.concurrency, args.rate, args.duration,
+                                          on_ready)
+            print(json.dumps(reports, indent=2) if args.format == "json" else format_comparison(reports))
+            return 0
+        if args.mode == "processes":
+            samples, elapsed = _run_processes(config, args.processes, args.concurrency, args.rate, args.duration,
+                                              on_ready)
+        else:
+            ctx = LoadContext(config)
+            on_ready()
+            start = time.perf_counter()
+            if args.mode == "threads":
+                samples = _run_threads(ctx, args.concurrency, args.rate, args.duration)
+            else:
+                samples = _run_asyncio(ctx, args.concurrency, args.rate, args.duration)
+            elapsed = time.perf_counter() - start
+    finally:
+        if mock:
+            mock.stop()
+
+    report = summarize(samples, elapsed)
+    print(json.dumps(report, indent=2) if args.format == "json" else format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
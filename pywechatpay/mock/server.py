@@ -0,0 +1,520 @@
+import datetime
+import json
+import random
+import re
+import sys
+import threading
+import time
+from base64 import b64decode
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.x509.oid import NameOID
+
+from ..constants import SIGNATURE_MESSAGE_FORMAT
+from ..utils.aes import encrypt_aes246gcm
+from ..utils.nonce import gen_noncestr
+from ..utils.sign import sign_sha256_with_rsa
+
+AUTHORIZATION_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+AUTHORIZATION_TYPE = "WECHATPAY2-SHA256-RSA2048"
+# 请求时间戳允许的最大偏差, 单位秒
+MAX_TIMESTAMP_SKEW = 300
+
+TRADE_TYPES = ("app", "h5", "jsapi", "native")
+
+
+def gen_platform_certificate(common_name: str = "Wechatpay Mock Platform"):
+    """
+    生成自签名的平台私钥和证书
+
+    :param common_name: 证书主体名称
+    :return: (私钥, 证书, 证书序列号)
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(private_key, SHA256())
+    )
+    serial_no = "%X" % certificate.serial_number
+    return private_key, certificate, serial_no
+
+
+class MockWechatPayServer:
+    """
+    本地模拟的微信支付 API 服务, 用于离线的集成测试和压力测试
+
+    - 自签发平台证书, 并以加密形式提供 /v3/certificates
+    - 支持 APP/H5/JSAPI/Native 下单, 订单查询, 申请退款和退款查询
+    - 校验请求的 Authorization 头, 并对应答签名
+    - 向回调地址推送签名和加密后的通知
+    - 可配置延迟和错误率
+    """
+
+    def __init__(self, mch_api_v3_key: str, host: str = "127.0.0.1", port: int = 0, latency: float = 0,
+                 latency_jitter: float = 0, error_rate: float = 0, verify_authorization: bool = True):
+        """
+
+        :param mch_api_v3_key: 商户APIv3密钥, 用于加密平台证书和通知
+        :param host: 监听地址
+        :param port: 监听端口, 0 表示随机端口
+        :param latency: 每个应答的固定延迟, 单位秒
+        :param latency_jitter: 在固定延迟上附加的随机延迟上限, 单位秒
+        :param error_rate: 返回 500 错误的概率, 0 到 1 之间
+        :param verify_authorization: 是否校验请求签名
+        """
+        self.mch_api_v3_key = mch_api_v3_key
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.verify_authorization = verify_authorization
+
+        self.platform_private_key, self.platform_certificate, self.platform_serial_no = gen_platform_certificate()
+
+        self.merchant_public_keys = {}
+        self.transactions = {}
+        self.refunds = {}
+        self.lock = threading.Lock()
+
+        self.httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        """服务地址, 用来替代 WECHAT_PAY_API_SERVER"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_merchant(self, mch_id: str, mch_cert_serial_no: str, public_key):
+        """
+        登记商户证书公钥, 用于校验请求签名
+
+        :param mch_id: 商户号
+        :param mch_cert_serial_no: 商户证书序列号
+        :param public_key: 商户证书公钥
+        :return:
+        """
+        self.merchant_public_keys[(mch_id, mch_cert_serial_no)] = public_key
+
+    def get_platform_certificate(self):
+        """平台证书访问器, 与 CertificateDownloader 的 get 接口一致, 可直接传给 SHA256WithRSAVerifier"""
+        return _CertificateGetter({self.platform_serial_no: self.platform_certificate})
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def sign_headers(self, body: str) -> dict:
+        """
+        生成应答或通知的签名头
+
+        :param body: 报文主体
+        :return:
+        """
+        timestamp = str(int(time.time()))
+        nonce = gen_noncestr()
+        message = "%s\n%s\n%s\n" % (timestamp, nonce, body)
+        return {
+            "Request-ID": gen_noncestr(),
+            "Wechatpay-Timestamp": timestamp,
+            "Wechatpay-Nonce": nonce,
+            "Wechatpay-Signature": sign_sha256_with_rsa(message, self.platform_private_key),
+            "Wechatpay-Serial": self.platform_serial_no,
+        }
+
+    def encrypt_resource(self, plaintext: str, associated_data: str) -> dict:
+        """
+        使用商户APIv3密钥加密数据
+
+        :param plaintext: 明文
+        :param associated_data: 附加数据
+        :return:
+        """
+        nonce = gen_noncestr(12)
+        return {
+            "algorithm": "AEAD_AES_256_GCM",
+            "nonce": nonce,
+            "associated_data": associated_data,
+            "ciphertext": encrypt_aes246gcm(self.mch_api_v3_key, nonce, plaintext, associated_data),
+        }
+
+    def check_authorization(self, method: str, path: str, body: str, authorization: str):
+        """
+        校验请求签名, 返回商户号. 不通过则返回 None
+
+        :param method: 请求方法
+        :param path: 请求路径, 包含查询串
+        :param body: 请求主体
+        :param authorization: Authorization 请求头
+        :return:
+        """
+        auth_type, _, params = authorization.partition(" ")
+        if auth_type != AUTHORIZATION_TYPE:
+            return None
+        fields = dict(AUTHORIZATION_PATTERN.findall(params))
+        try:
+            mch_id = fields["mchid"]
+            timestamp = int(fields["timestamp"])
+            public_key = self.merchant_public_keys[(mch_id, fields["serial_no"])]
+            if abs(time.time() - timestamp) > MAX_TIMESTAMP_SKEW:
+                return None
+            message = SIGNATURE_MESSAGE_FORMAT % (method, path, timestamp, fields["nonce_str"], body)
+            public_key.verify(b64decode(fields["signature"]), str.encode(message), PKCS1v15(), SHA256())
+        except Exception:
+            return None
+        return mch_id
+
+    def certificates(self) -> dict:
+        """平台证书列表应答"""
+        certificate = self.platform_certificate
+        certificate_pem = certificate.public_bytes(serialization.Encoding.PEM).decode()
+        return {
+            "data": [
+                {
+                    "serial_no": self.platform_serial_no,
+                    "effective_time": _cert_time(certificate, "not_valid_before").isoformat(),
+                    "expire_time": _cert_time(certificate, "not_valid_after").isoformat(),
+                    "encrypt_certificate": self.encrypt_resource(certificate_pem, "certificate"),
+                }
+            ]
+        }
+
+    def create_transaction(self, trade_type: str, mch_id: str, content: dict):
+        """
+        下单, 返回 (状态码, 应答)
+
+        :param trade_type: 交易类型
+        :param mch_id: 发起请求的商户号
+        :param content: 请求内容
+        :return:
+        """
+        out_trade_no = content.get("out_trade_no")
+        if not out_trade_no or content.get("mchid") != mch_id or "amount" not in content:
+            return 400, {"code": "PARAM_ERROR", "message": "参数错误"}
+
+        with self.lock:
+            transaction = self.transactions.get((mch_id, out_trade_no))
+            if transaction is None:
+                transaction = {
+                    "appid": content.get("appid", ""),
+                    "mchid": mch_id,
+                    "out_trade_no": out_trade_no,
+                    "transaction_id": "42%026d" % random.randrange(10 ** 26),
+                    "trade_type": trade_type.upper(),
+                    "trade_state": "NOTPAY",
+                    "trade_state_desc": "订单未支付",
+                    "amount": {"total": content["amount"].get("total", 0),
+                               "currency": content["amount"].get("currency", "CNY")},
+                    "prepay_id": "wx" + gen_noncestr(30),
+                    "notify_url": content.get("notify_url", ""),
+                }
+                self.transactions[(mch_id, out_trade_no)] = transaction
+
+        prepay_id = transaction["prepay_id"]
+        if trade_type == "h5":
+            return 200, {"h5_url": f"https://wx.tenpay.com/cgi-bin/mmpayweb-bin/checkmweb?prepay_id={prepay_id}"}
+        if trade_type == "native":
+            return 200, {"code_url": f"weixin://wxpay/bizpayurl?pr={prepay_id[-7:]}"}
+        return 200, {"prepay_id": prepay_id}
+
+    def query_transaction(self, mch_id: str, out_trade_no: str = None, transaction_id: str = None):
+        """
+        查询订单, 返回 (状态码, 应答)
+
+        :param mch_id: 商户号
+        :param out_trade_no: 商户订单号
+        :param transaction_id: 微信支付订单号
+        :return:
+        """
+        transaction = self.find_transaction(mch_id, out_trade_no, transaction_id)
+        if transaction is None:
+            return 404, {"code": "ORDER_NOT_EXIST", "message": "订单不存在"}
+        return 200, self.transaction_resource(transaction)
+
+    def find_transaction(self, mch_id: str, out_trade_no: str = None, transaction_id: str = None):
+        if out_trade_no is not None:
+            return self.transactions.get((mch_id, out_trade_no))
+        for transaction in list(self.transactions.values()):
+            if transaction["mchid"] == mch_id and transaction["transaction_id"] == transaction_id:
+                return transaction
+        return None
+
+    @staticmethod
+    def transaction_resource(transaction: dict) -> dict:
+        return {k: v for k, v in transaction.items() if k not in ("prepay_id", "notify_url")}
+
+    def create_refund(self, mch_id: str, content: dict):
+        """
+        申请退款, 返回 (状态码, 应答). 同一商户退款单号重复申请时返回原退款单
+
+        :param mch_id: 发起请求的商户号
+        :param content: 请求内容
+        :return:
+        """
+        out_refund_no = content.get("out_refund_no")
+        amount = content.get("amount") or {}
+        if not out_refund_no or "refund" not in amount or "total" not in amount:
+            return 400, {"code": "PARAM_ERROR", "message": "参数错误"}
+
+        with self.lock:
+            refund = self.refunds.get((mch_id, out_refund_no))
+            if refund is not None:
+                return 200, refund
+
+            transaction = self.find_transaction(mch_id, content.get("out_trade_no"), content.get("transaction_id"))
+            if transaction is None:
+                return 404, {"code": "RESOURCE_NOT_EXISTS", "message": "订单不存在"}
+            if transaction["trade_state"] not in ("SUCCESS", "REFUND"):
+                return 400, {"code": "INVALID_REQUEST", "message": "订单未支付"}
+            refunded = transaction.get("refunded", 0)
+            if amount["total"] != transaction["amount"]["total"] or refunded + amount["refund"] > amount["total"]:
+                return 400, {"code": "NOT_ENOUGH", "message": "退款金额超过订单可退金额"}
+
+            transaction["refunded"] = refunded + amount["refund"]
+            transaction["trade_state"] = "REFUND"
+            transaction["trade_state_desc"] = "转入退款"
+            now = time.strftime("%Y-%m-%dT%H:%M:%S+08:00")
+            refund = {
+                "refund_id": "50%026d" % random.randrange(10 ** 26),
+                "out_refund_no": out_refund_no,
+                "transaction_id": transaction["transaction_id"],
+                "out_trade_no": transaction["out_trade_no"],
+                "channel": "ORIGINAL",
+                "user_received_account": "支付用户零钱",
+                "status": "SUCCESS",
+                "create_time": now,
+                "success_time": now,
+                "amount": {
+                    "total": amount["total"],
+                    "refund": amount["refund"],
+                    "payer_total": amount["total"],
+                    "payer_refund": amount["refund"],
+                    "currency": amount.get("currency", "CNY"),
+                },
+            }
+            self.refunds[(mch_id, out_refund_no)] = refund
+        return 200, refund
+
+    def query_refund(self, mch_id: str, out_refund_no: str):
+        """
+        查询退款, 返回 (状态码, 应答)
+
+        :param mch_id: 商户号
+        :param out_refund_no: 商户退款单号
+        :return:
+        """
+        refund = self.refunds.get((mch_id, out_refund_no))
+        if refund is None:
+            return 404, {"code": "RESOURCE_NOT_EXISTS", "message": "退款单不存在"}
+        return 200, refund
+
+    def pay_transaction(self, mch_id: str, out_trade_no: str, notify_url: str = None) -> dict:
+        """
+        模拟用户完成支付, 并向回调地址推送支付成功通知
+
+        :param mch_id: 商户号
+        :param out_trade_no: 商户订单号
+        :param notify_url: 回调地址, 不传则使用下单时的 notify_url
+        :return: 通知请求的应答
+        """
+        with self.lock:
+            transaction = self.transactions[(mch_id, out_trade_no)]
+            transaction["trade_state"] = "SUCCESS"
+            transaction["trade_state_desc"] = "支付成功"
+            transaction["success_time"] = time.strftime("%Y-%m-%dT%H:%M:%S+08:00")
+            transaction["amount"]["payer_total"] = transaction["amount"]["total"]
+            transaction["amount"]["payer_currency"] = transaction["amount"]["currency"]
+        return self.send_notify(notify_url or transaction["notify_url"], self.transaction_resource(transaction))
+
+    def gen_notify(self, resource: dict, event_type: str = "TRANSACTION.SUCCESS",
+                   original_type: str = "transaction"):
+        """
+        生成签名和加密后的通知, 返回 (请求头, 请求主体)
+
+        :param resource: 通知资源明文
+        :param event_type: 通知类型
+        :param original_type: 原始回调类型
+        :return:
+        """
+        encrypted = self.encrypt_resource(json.dumps(resource), original_type)
+        encrypted["original_type"] = original_type
+        body = json.dumps({
+            "id": gen_noncestr(36),
+            "create_time": time.strftime("%Y-%m-%dT%H:%M:%S+08:00"),
+            "resource_type": "encrypt-resource",
+            "event_type": event_type,
+            "summary": "支付成功",
+            "resource": encrypted,
+        })
+        headers = self.sign_headers(body)
+        headers["Content-Type"] = "application/json"
+        return headers, body
+
+    def send_notify(self, notify_url: str, resource: dict, event_type: str = "TRANSACTION.SUCCESS",
+                    original_type: str = "transaction", timeout: float = 5):
+        """
+        向回调地址推送通知
+
+        :param notify_url: 回调地址
+        :param resource: 通知资源明文
+        :param event_type: 通知类型
+        :param original_type: 原始回调类型
+        :param timeout: 超时时间
+        :return:
+        """
+        headers, body = self.gen_notify(resource, event_type, original_type)
+        return requests.post(notify_url, data=body.encode(), headers=headers, timeout=timeout)
+
+
+def _cert_time(certificate, name: str):
+    # cryptography>=42 提供带时区的 *_utc 属性, 旧版本只有不带时区的属性
+    value = getattr(certificate, name + "_utc", None)
+    if value is None:
+        value = getattr(certificate, name).replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class _CertificateGetter:
+    def __init__(self, certificates: dict):
+        self.certificates = certificates
+
+    def get(self, serial_no: str):
+        return self.certificates.get(serial_no)
+
+    def get_all(self) -> dict:
+        return dict(self.certificates)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有 5, 同时建立更多连接时多出的连接要等约 1s 的 SYN 重传
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # 客户端超时断开时写应答会失败, 属于预期情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 应答头和主体分开写入, 不关闭 Nagle 算法时每个请求会多出约 40ms 的延迟确认等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_HEAD(self):
+        # 供预热建立连接使用, 保持连接不关闭
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def handle_request(self, method: str):
+        mock = self.server.mock
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+
+        delay = mock.latency + random.uniform(0, mock.latency_jitter) if mock.latency_jitter else mock.latency
+        if delay:
+            time.sleep(delay)
+
+        if mock.error_rate and random.random() < mock.error_rate:
+            return self.reply(500, {"code": "SYSTEM_ERROR", "message": "系统错误"})
+
+        mch_id = mock.check_authorization(method, self.path, body, self.headers.get("Authorization", ""))
+        if mch_id is None:
+            if mock.verify_authorization:
+                return self.reply(401, {"code": "SIGN_ERROR", "message": "签名错误"})
+            mch_id = dict(AUTHORIZATION_PATTERN.findall(self.headers.get("Authorization", ""))).get("mchid", "")
+
+        status, data = self.route(method, mch_id, body)
+        self.reply(status, data)
+
+    def route(self, method: str, mch_id: str, body: str):
+        mock = self.server.mock
+        up = urlparse(self.path)
+        path = up.path
+        query = {k: v[0] for k, v in parse_qs(up.query).items()}
+
+        if method == "GET" and path == "/v3/certificates":
+            return 200, mock.certificates()
+
+        if method == "POST" and path.startswith("/v3/pay/transactions/"):
+            trade_type = path[len("/v3/pay/transactions/"):]
+            if trade_type in TRADE_TYPES:
+                try:
+                    content = json.loads(body)
+                except ValueError:
+                    return 400, {"code": "PARAM_ERROR", "message": "请求主体不是合法的 JSON"}
+                return mock.create_transaction(trade_type, mch_id, content)
+
+        if path == "/v3/refund/domestic/refunds" and method == "POST":
+            try:
+                content = json.loads(body)
+            except ValueError:
+                return 400, {"code": "PARAM_ERROR", "message": "请求主体不是合法的 JSON"}
+            return mock.create_refund(mch_id, content)
+
+        if path.startswith("/v3/refund/domestic/refunds/") and method == "GET":
+            return mock.query_refund(mch_id, path.rsplit("/", 1)[1])
+
+        if method == "GET" and query.get("mchid") == mch_id:
+            if path.startswith("/v3/pay/transactions/out-trade-no/"):
+                return mock.query_transaction(mch_id, out_trade_no=path.rsplit("/", 1)[1])
+            if path.startswith("/v3/pay/transactions/id/"):
+                return mock.query_transaction(mch_id, transaction_id=path.rsplit("/", 1)[1])
+
+        return 404, {"code": "NOT_FOUND", "message": "接口不存在"}
+
+    def reply(self, status: int, data: dict):
+        mock = self.server.mock
+        body = json.dumps(data)
+        headers = mock.sign_headers(body)
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
@@ -1,7 +1,6 @@
 import time
 
 from ..service import ServiceABC
-from ...constants import WECHAT_PAY_API_SERVER
 from ...utils.nonce import gen_noncestr
 
 
@@ -31,7 +30,7 @@ class AppApiService(ServiceABC):
             "amount": {"total": total, "currency": currency},
         }
         content.update(kwargs)
-        url = WECHAT_PAY_API_SERVER + "/v3/pay/transactions/app"
+        url = self.api_server + "/v3/pay/transactions/app"
         result = self.client.request("post", url, json=content)
         return result.json()
 
@@ -77,7 +76,7 @@ class AppApiService(ServiceABC):
         :param transaction_id: 微信支付订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
 
@@ -89,6 +88,6 @@ class AppApiService(ServiceABC):
         :param out_trade_no: 商户订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
@@ -1,5 +1,4 @@
 from ..service import ServiceABC
-from ...constants import WECHAT_PAY_API_SERVER
 
 
 class H5ApiService(ServiceABC):
@@ -35,7 +34,7 @@ class H5ApiService(ServiceABC):
             },
         }
         content.update(kwargs)
-        url = WECHAT_PAY_API_SERVER + "/v3/pay/transactions/h5"
+        url = self.api_server + "/v3/pay/transactions/h5"
         result = self.client.request("post", url, json=content)
         return result.json()
 
@@ -47,7 +46,7 @@ class H5ApiService(ServiceABC):
         :param transaction_id: 微信支付订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
 
@@ -59,6 +58,6 @@ class H5ApiService(ServiceABC):
         :param out_trade_no: 商户订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
@@ -1,7 +1,6 @@
 import time
 
 from ..service import ServiceABC
-from ...constants import WECHAT_PAY_API_SERVER
 from ...utils.nonce import gen_noncestr
 
 
@@ -33,7 +32,7 @@ class JsapiApiService(ServiceABC):
             "payer": {"openid": openid}
         }
         content.update(kwargs)
-        url = WECHAT_PAY_API_SERVER + "/v3/pay/transactions/h5"
+        url = self.api_server + "/v3/pay/transactions/h5"
         result = self.client.request("post", url, json=content)
         return result.json()
 
@@ -80,7 +79,7 @@ class JsapiApiService(ServiceABC):
         :param transaction_id: 微信支付订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/id/{transaction_id}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
 
@@ -92,6 +91,6 @@ class JsapiApiService(ServiceABC):
         :param out_trade_no: 商户订单号
         :return:
         """
-        url = WECHAT_PAY_API_SERVER + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
+        url = self.api_server + f"/v3/pay/transactions/out-trade-no/{out_trade_no}?mchid={mchid}"
         result = self.client.request("get", url)
         return result.json()
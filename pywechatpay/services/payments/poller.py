@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 订单的最终状态, 到达后不再查询
+FINAL_TRADE_STATES = frozenset(["SUCCESS", "REFUND", "CLOSED", "REVOKED", "PAYERROR"])
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingOrder:
+    __slots__ = ("mchid", "out_trade_no", "created", "attempts", "cancelled")
+
+    def __init__(self, mchid: str, out_trade_no: str, created: float):
+        self.mchid = mchid
+        self.out_trade_no = out_trade_no
+        self.created = created
+        self.attempts = 0
+        self.cancelled = False
+
+
+class OrderStatusPoller:
+    """
+    待支付订单状态轮询器
+
+    所有订单放在一个按下次查询时间排序的堆中, 由一个调度线程取出到期的订单, 交给有限并发的线程池查询.
+    查询间隔随订单年龄增长: interval = clamp(年龄 * interval_ratio, min_interval, max_interval).
+    订单到达最终状态后从轮询器中移除, 并调用回调. 查询, 回调或 on_expire 出错时调用 on_error,
+    回调出错的订单已经移除, 不会再查询, 需要在 on_error 中处理. 没有 on_error 或 on_error 本身出错时记录日志
+    """
+
+    def __init__(self, svc, callback, concurrency: int = 8, min_interval: float = 5, max_interval: float = 300,
+                 interval_ratio: float = 0.2, max_age: float = None, on_expire=None, on_error=None):
+        """
+
+        :param svc: 支付接口服务, 如 AppApiService, 需要提供 pay_transactions_out_trade_no
+        :param callback: 订单到达最终状态时的回调, 参数为订单查询结果
+        :param concurrency: 同时进行的查询数
+        :param min_interval: 最小查询间隔, 单位秒
+        :param max_interval: 最大查询间隔, 单位秒
+        :param interval_ratio: 查询间隔与订单年龄的比例
+        :param max_age: 订单最长轮询时间, 单位秒, 超过后移除并调用 on_expire. 不传则一直轮询
+        :param on_expire: 订单超时的回调, 参数为 (商户号, 商户订单号), 与 callback 一样在线程池中执行
+        :param on_error: 出错的回调, 参数为 (商户号, 商户订单号, 异常). 查询出错的订单会按正常间隔再次查询
+        """
+        self.svc = svc
+        self.callback = callback
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval_ratio = interval_ratio
+        self.max_age = max_age
+        self.on_expire = on_expire
+        self.on_error = on_error
+
+        self.orders = {}
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.executor = None
+        self.thread = None
+        self.running = False
+
+    def __len__(self):
+        return len(self.orders)
+
+    def interval(self, age: float) -> float:
+        """
+        根据订单年龄计算查询间隔
+
+        :param age: 订单年龄, 单位秒
+        :return:
+        """
+        return min(self.max_interval, max(self.min_interval, age * self.interval_ratio))
+
+    def add(self, mchid: str, out_trade_no: str, created_at: float = None) -> bool:
+        """
+        添加待轮询的订单, 已在轮询中则返回 False
+
+        :param mchid: 直连商户号
+        :param out_trade_no: 商户订单号
+        :param created_at: 下单时间, time.time() 格式, 不传则为当前时间
+        :return:
+        """
+        now = time.monotonic()
+        created = now - (time.time() - created_at) if created_at is not None else now
+        key = (mchid, out_trade_no)
+        with self.cond:
+            if key in self.orders:
+                return False
+            order = _PendingOrder(mchid, out_trade_no, created)
+            self.orders[key] = order
+            self._schedule(order, now)
+            self.cond.notify()
+        return True
+
+    def remove(self, mchid: str, out_trade_no: str) -> bool:
+        """
+        停止轮询订单, 如已通过支付通知得知结果
+
+        :param mchid: 直连商户号
+        :param out_trade_no: 商户订单号
+        :return:
+        """
+        with self.cond:
+            order = self.orders.pop((mchid, out_trade_no), None)
+            if order is None:
+                return False
+            order.cancelled = True
+        return True
+
+    def start(self):
+        """启动调度线程"""
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.executor = ThreadPoolExecutor(self.concurrency)
+            self.thread = threading.Thread(target=self._run, name="pywechatpay-poller", daemon=True)
+            self.thread.start()
+
+    def stop(self, wait: bool = True):
+        """
+        停止调度, 未到达最终状态的订单保留在轮询器中, 可再次 start
+
+        :param wait: 是否等待进行中的查询完成
+        :return:
+        """
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+        self.executor.shutdown(wait=wait)
+
+    def _schedule(self, order: _PendingOrder, now: float):
+        due = now + self.interval(now - order.created)
+        heapq.heappush(self.heap, (due, next(self.seq), order))
+
+    def _run(self):
+        while True:
+            with self.cond:
+                order = None
+                while self.running:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    due, _, order = self.heap[0]
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        self.cond.wait(delay)
+                        continue
+                    heapq.heappop(self.heap)
+                    if not order.cancelled:
+                        break
+                if not self.running:
+                    if order is not None and not order.cancelled:
+                        self._schedule(order, time.monotonic())
+                    return
+
+            if self.max_age is not None and time.monotonic() - order.created > self.max_age:
+                if self.remove(order.mchid, order.out_trade_no) and self.on_expire:
+                    # 与回调一样在线程池中执行, 避免慢的 on_expire 阻塞调度
+                    self.semaphore.acquire()
+                    self.executor.submit(self._expire, order)
+                continue
+
+            self.semaphore.acquire()
+            self.executor.submit(self._poll, order)
+
+    def _expire(self, order: _PendingOrder):
+        try:
+            self._safe_call(order, self.on_expire, order.mchid, order.out_trade_no)
+        finally:
+            self.semaphore.release()
+
+    def _poll(self, order: _PendingOrder):
+        try:
+            order.attempts += 1
+            try:
+                result = self.svc.pay_transactions_out_trade_no(order.mchid, order.out_trade_no)
+            except Exception as ex:
+                self._report_error(order, ex)
+                result = None
+
+            if result is not None and result.get("trade_state") in FINAL_TRADE_STATES:
+                if self.remove(order.mchid, order.out_trade_no):
+                    self._safe_call(order, self.callback, result)
+                return
+
+            with self.cond:
+                if not order.cancelled:
+                    self._schedule(order, time.monotonic())
+                    self.cond.notify()
+        finally:
+            self.semaphore.release()
+
+    def _safe_call(self, order: _PendingOrder, func, *args):
+        try:
+            func(*args)
+        except Exception as ex:
+            self._report_error(order, ex)
+
+    def _report_error(self, order: _PendingOrder, ex: Exception):
+        if self.on_error:
+            try:
+                self.on_error(order.mchid, order.out_trade_no, ex)
+                return
+            except Exception:
+                logger.exception("on_error failed for order %s %s", order.mchid, order.out_trade_no)
+        logger.error("polling order %s %s failed", order.mchid, order.out_trade_no, exc_info=ex)
@@ -0,0 +1,149 @@
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from .refunds import RefundsApiService
+from ...exceptions import WechatPayAPIException
+
+# 批量退款中单笔退款的结果状态
+REFUND_SUBMITTED = "SUBMITTED"  # 退款申请已受理
+REFUND_REJECTED = "REJECTED"  # 退款申请被拒绝, 如参数错误, 订单未支付或可退金额不足, 不会重新提交
+REFUND_FAILED = "FAILED"  # 网络错误, 超时或微信支付系统错误等, 下次运行时会重新提交
+REFUND_SKIPPED = "SKIPPED"  # 重复的退款单号, 或检查点中已受理或已被拒绝
+
+# 退款处理中的状态, 需要查询才能得知最终结果
+REFUND_STATUS_PROCESSING = "PROCESSING"
+
+RefundResult = namedtuple("RefundResult", ["out_refund_no", "status", "result", "error"])
+
+
+class BulkRefundExecutor:
+    """
+    批量退款执行器
+
+    以有限的并发提交退款申请, 按商户退款单号去重, 并以流的方式返回每笔退款的结果.
+    接口返回 permanent_status_codes 中的状态码时, 退款记为 REFUND_REJECTED, 其他错误记为 REFUND_FAILED.
+    指定检查点文件时, 每笔结果都会追加到文件中, 崩溃后重新运行会跳过已受理和已被拒绝的退款, 只重新提交失败和未提交的退款.
+    微信支付对同一商户退款单号的重复申请是幂等的, 因此重新提交不会重复退款.
+    受理后仍在处理中的退款, 可以用 query_processing 查询最新状态
+    """
+
+    # 退款申请被拒绝且重试也不会成功的状态码, 如 PARAM_ERROR, INVALID_REQUEST, NOT_ENOUGH, RESOURCE_NOT_EXISTS
+    permanent_status_codes = frozenset([400, 404])
+
+    def __init__(self, svc: RefundsApiService, concurrency: int = 8, checkpoint_path: str = None):
+        """
+
+        :param svc: 退款接口服务
+        :param concurrency: 同时进行的退款请求数
+        :param checkpoint_path: 检查点文件路径, JSON Lines 格式
+        """
+        self.svc = svc
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+
+    def load_records(self) -> dict:
+        """读取检查点中每个商户退款单号的最新记录"""
+        records = {}
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return records
+        with open(self.checkpoint_path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能没有写完整
+                    continue
+                records[record["out_refund_no"]] = record
+        return records
+
+    def load_checkpoint(self) -> set:
+        """读取检查点中已受理或已被拒绝, 不需要重新提交的商户退款单号"""
+        return {no for no, record in self.load_records().items()
+                if record.get("status") in (REFUND_SUBMITTED, REFUND_REJECTED)}
+
+    def load_processing(self) -> set:
+        """读取检查点中已受理, 但最近一次得知的退款状态仍为处理中的商户退款单号"""
+        return {no for no, record in self.load_records().items()
+                if record.get("status") == REFUND_SUBMITTED
+                and record.get("refund_status") == REFUND_STATUS_PROCESSING}
+
+    def run(self, refund_requests):
+        """
+        提交退款申请, 按完成顺序逐个返回 RefundResult
+
+        :param refund_requests: 退款申请的可迭代对象, 每项为 refund_domestic_refunds 的参数字典, 必须包含 out_refund_no
+        :return:
+        """
+        submitted = self.load_checkpoint()
+        seen = set()
+        checkpoint = open(self.checkpoint_path, "a", encoding="utf8") if self.checkpoint_path else None
+        try:
+            with ThreadPoolExecutor(self.concurrency) as pool:
+                pending = set()
+                for request in refund_requests:
+                    out_refund_no = request["out_refund_no"]
+                    if out_refund_no in seen or out_refund_no in submitted:
+                        yield RefundResult(out_refund_no, REFUND_SKIPPED, None, None)
+                        continue
+                    seen.add(out_refund_no)
+
+                    if len(pending) >= self.concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield self._record(checkpoint, future.result())
+                    pending.add(pool.submit(self._refund, request))
+
+                for future in as_completed(pending):
+                    yield self._record(checkpoint, future.result())
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+    def query_processing(self, out_refund_nos=None):
+        """
+        查询处理中的退款, 按完成顺序逐个返回 RefundResult, status 仍为 REFUND_SUBMITTED, result 为查询结果.
+        查询出错时 result 为 None, error 为错误信息. 查询结果会追加到检查点中
+
+        :param out_refund_nos: 要查询的商户退款单号, 不传则查询检查点中处理中的退款
+        :return:
+        """
+        if out_refund_nos is None:
+            out_refund_nos = self.load_processing()
+        checkpoint = open(self.checkpoint_path, "a", encoding="utf8") if self.checkpoint_path else None
+        try:
+            with ThreadPoolExecutor(self.concurrency) as pool:
+                futures = [pool.submit(self._query, no) for no in out_refund_nos]
+                for future in as_completed(futures):
+                    result = future.result()
+                    yield self._record(checkpoint, result) if result.error is None else result
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+    def _refund(self, request: dict) -> RefundResult:
+        try:
+            result = self.svc.refund_domestic_refunds(**request)
+        except WechatPayAPIException as ex:
+            status = REFUND_REJECTED if ex.status_code in self.permanent_status_codes else REFUND_FAILED
+            return RefundResult(request["out_refund_no"], status, None, str(ex))
+        except Exception as ex:
+            return RefundResult(request["out_refund_no"], REFUND_FAILED, None, str(ex))
+        return RefundResult(request["out_refund_no"], REFUND_SUBMITTED, result, None)
+
+    def _query(self, out_refund_no: str) -> RefundResult:
+        try:
+            result = self.svc.refund_domestic_refunds_out_refund_no(out_refund_no)
+        except Exception as ex:
+            return RefundResult(out_refund_no, REFUND_SUBMITTED, None, str(ex))
+        return RefundResult(out_refund_no, REFUND_SUBMITTED, result, None)
+
+    @staticmethod
+    def _record(checkpoint, result: RefundResult) -> RefundResult:
+        if checkpoint:
+            checkpoint.write(json.dumps({"out_refund_no": result.out_refund_no, "status": result.status,
+                                         "refund_status": (result.result or {}).get("status"),
+                                         "error": result.error}) + "\n")
+            checkpoint.flush()
+        return result
@@ -0,0 +1,50 @@
+from ..service import ServiceABC
+
+
+class RefundsApiService(ServiceABC):
+    def refund_domestic_refunds(self, out_refund_no: str, refund: int, total: int, transaction_id: str = None,
+                                out_trade_no: str = None, reason: str = None, notify_url: str = None,
+                                currency: str = "CNY", **kwargs) -> dict:
+        """
+        申请退款API
+        https://pay.weixin.qq.com/wiki/doc/apiv3/apis/chapter3_2_9.shtml
+
+        :param out_refund_no: 商户退款单号
+        :param refund: 退款金额，单位为分
+        :param total: 原订单金额，单位为分
+        :param transaction_id: 微信支付订单号, 与 out_trade_no 二选一
+        :param out_trade_no: 商户订单号, 与 transaction_id 二选一
+        :param reason: 退款原因
+        :param notify_url: 退款结果回调url
+        :param currency: 退款币种, CNY：人民币
+        :param kwargs: 可选参数
+        :return:
+        """
+        content = {
+            "out_refund_no": out_refund_no,
+            "amount": {"refund": refund, "total": total, "currency": currency},
+        }
+        if transaction_id:
+            content["transaction_id"] = transaction_id
+        if out_trade_no:
+            content["out_trade_no"] = out_trade_no
+        if reason:
+            content["reason"] = reason
+        if notify_url:
+            content["notify_url"] = notify_url
+        content.update(kwargs)
+        url = self.api_server + "/v3/refund/domestic/refunds"
+        result = self.client.request("post", url, json=content)
+        return result.json()
+
+    def refund_domestic_refunds_out_refund_no(self, out_refund_no: str) -> dict:
+        """
+        查询单笔退款API
+        https://pay.weixin.qq.com/wiki/doc/apiv3/apis/chapter3_2_10.shtml
+
+        :param out_refund_no: 商户退款单号
+        :return:
+        """
+        url = self.api_server + f"/v3/refund/domestic/refunds/{out_refund_no}"
+        result = self.client.request("get", url)
+        return result.json()
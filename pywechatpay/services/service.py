@@ -1,8 +1,15 @@
 from abc import ABCMeta
 
+from ..constants import WECHAT_PAY_API_SERVER
 from ..core.client import Client
 
 
 class ServiceABC(metaclass=ABCMeta):
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, api_server: str = WECHAT_PAY_API_SERVER):
+        """
+
+        :param client: 客户端
+        :param api_server: 微信支付 API 地址, 可替换为本地模拟服务的地址
+        """
         self.client = client
+        self.api_server = api_server
@@ -1,4 +1,4 @@
-from base64 import b64decode
+from base64 import b64decode, b64encode
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
@@ -10,3 +10,11 @@ def decrypt_aes246gcm(key: str, nonce: str, ciphertext: str, associated_data: st
     data = b64decode(ciphertext)
     aesgcm = AESGCM(key_bytes)
     return aesgcm.decrypt(nonce_bytes, data, ad_bytes).decode()
+
+
+def encrypt_aes246gcm(key: str, nonce: str, plaintext: str, associated_data: str) -> str:
+    key_bytes = str.encode(key)
+    nonce_bytes = str.encode(nonce)
+    ad_bytes = str.encode(associated_data)
+    aesgcm = AESGCM(key_bytes)
+    return b64encode(aesgcm.encrypt(nonce_bytes, str.encode(plaintext), ad_bytes)).decode()
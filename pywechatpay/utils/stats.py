@@ -0,0 +1,15 @@
+import math
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    最近秩法计算分位数
+
+    :param values: 已排序的数值
+    :param p: 百分位, 0 到 100
+    :return:
+    """
+    if not values:
+        return 0.0
+    k = max(math.ceil(len(values) * p / 100.0) - 1, 0)
+    return values[min(k, len(values) - 1)]
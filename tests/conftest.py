@@ -0,0 +1,60 @@
+import socket
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from pywechatpay.core.client import with_wechat_pay_auto_auth_cipher_using_downloader_mgr
+from pywechatpay.core.downloader_mgr import CertificateDownloaderMgr
+from pywechatpay.core.notify import new_notify_handler
+from pywechatpay.core.verifier import SHA256WithRSAVerifier
+from pywechatpay.mock.server import MockWechatPayServer
+
+MCH_ID = "1900000001"
+MCH_CERT_SERIAL_NO = "MOCKMERCHANTSERIAL"
+MCH_API_V3_KEY = "0123456789abcdef0123456789abcdef"
+APPID = "wxd678efh567hg6787"
+
+
+def unused_port() -> int:
+    """本机当前没有被监听的端口, 连接会被拒绝"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mch_private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(scope="session")
+def mch_private_key_string(mch_private_key):
+    return mch_private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()).decode()
+
+
+@pytest.fixture
+def mock_server(mch_private_key):
+    with MockWechatPayServer(MCH_API_V3_KEY) as server:
+        server.add_merchant(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key.public_key())
+        yield server
+
+
+@pytest.fixture
+def downloader_mgr(mock_server, mch_private_key_string):
+    mgr = CertificateDownloaderMgr()
+    mgr.register_downloader_with_private_key(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY,
+                                             api_server=mock_server.base_url)
+    return mgr
+
+
+@pytest.fixture
+def client(downloader_mgr, mch_private_key_string):
+    return with_wechat_pay_auto_auth_cipher_using_downloader_mgr(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string,
+                                                                 downloader_mgr)
+
+
+@pytest.fixture
+def notify_handler(downloader_mgr):
+    return new_notify_handler(MCH_API_V3_KEY, SHA256WithRSAVerifier(downloader_mgr.get_certificate_visitor(MCH_ID)))
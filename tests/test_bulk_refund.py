@@ -0,0 +1,94 @@
+import threading
+
+import requests
+
+from pywechatpay.services.refunddomestic.bulk import BulkRefundExecutor, REFUND_FAILED, REFUND_REJECTED, \
+    REFUND_SKIPPED, REFUND_SUBMITTED
+from pywechatpay.services.refunddomestic.refunds import RefundsApiService
+from .conftest import MCH_ID
+
+
+def paid_transaction(mock_server, out_trade_no: str, total: int = 100):
+    mock_server.create_transaction("app", MCH_ID, {"mchid": MCH_ID, "out_trade_no": out_trade_no,
+                                                   "amount": {"total": total}})
+    mock_server.transactions[(MCH_ID, out_trade_no)]["trade_state"] = "SUCCESS"
+
+
+def refund_request(no: str) -> dict:
+    return {"out_refund_no": f"refund-{no}", "out_trade_no": f"trade-{no}", "refund": 100, "total": 100}
+
+
+class FlakyRefundsApiService(RefundsApiService):
+    """对 unreachable 中的退款单号模拟网络错误"""
+
+    unreachable = set()
+
+    def refund_domestic_refunds(self, out_refund_no, *args, **kwargs):
+        if out_refund_no in self.unreachable:
+            raise requests.ConnectionError("connection refused")
+        return super().refund_domestic_refunds(out_refund_no, *args, **kwargs)
+
+
+def test_checkpoint_resume_only_resubmits_failed_refunds(mock_server, client, tmp_path):
+    for no in ("1", "2", "4"):
+        paid_transaction(mock_server, f"trade-{no}")
+    svc = FlakyRefundsApiService(client, api_server=mock_server.base_url)
+    svc.unreachable = {"refund-4"}
+    checkpoint_path = str(tmp_path / "refunds.jsonl")
+    # refund-3 的订单不存在, 会被拒绝
+    refund_requests = [refund_request(no) for no in ("1", "2", "3", "4", "1")]
+
+    first = [(r.out_refund_no, r.status) for r in BulkRefundExecutor(svc, 2, checkpoint_path).run(refund_requests)]
+    assert sorted(first) == [("refund-1", REFUND_SKIPPED), ("refund-1", REFUND_SUBMITTED),
+                             ("refund-2", REFUND_SUBMITTED), ("refund-3", REFUND_REJECTED),
+                             ("refund-4", REFUND_FAILED)]
+
+    svc.unreachable = set()
+    second = [(r.out_refund_no, r.status) for r in BulkRefundExecutor(svc, 2, checkpoint_path).run(refund_requests)]
+    assert sorted(second) == [("refund-1", REFUND_SKIPPED), ("refund-1", REFUND_SKIPPED),
+                              ("refund-2", REFUND_SKIPPED), ("refund-3", REFUND_SKIPPED),
+                              ("refund-4", REFUND_SUBMITTED)]
+    assert BulkRefundExecutor(svc, 2, checkpoint_path).load_checkpoint() == {"refund-1", "refund-2", "refund-3",
+                                                                             "refund-4"}
+
+
+def test_query_processing_refunds(tmp_path):
+    class ProcessingService:
+        def refund_domestic_refunds(self, out_refund_no, **kwargs):
+            return {"out_refund_no": out_refund_no, "status": "PROCESSING"}
+
+        def refund_domestic_refunds_out_refund_no(self, out_refund_no):
+            if out_refund_no == "refund-2":
+                raise requests.ConnectionError("connection refused")
+            return {"out_refund_no": out_refund_no, "status": "SUCCESS"}
+
+    executor = BulkRefundExecutor(ProcessingService(), 2, str(tmp_path / "refunds.jsonl"))
+    assert len(list(executor.run([{"out_refund_no": "refund-1"}, {"out_refund_no": "refund-2"}]))) == 2
+    assert executor.load_processing() == {"refund-1", "refund-2"}
+
+    results = {r.out_refund_no: r for r in executor.query_processing()}
+    assert results["refund-1"].result["status"] == "SUCCESS"
+    assert results["refund-2"].result is None and "connection refused" in results["refund-2"].error
+    assert executor.load_processing() == {"refund-2"}
+    assert executor.load_checkpoint() == {"refund-1", "refund-2"}
+
+
+def test_results_are_yielded_as_they_complete(tmp_path):
+    release = threading.Event()
+
+    class SlowService:
+        def refund_domestic_refunds(self, out_refund_no, **kwargs):
+            if out_refund_no == "refund-slow":
+                release.wait(5)
+            return {"out_refund_no": out_refund_no}
+
+    checkpoint_path = tmp_path / "refunds.jsonl"
+    results = BulkRefundExecutor(SlowService(), 4, str(checkpoint_path)).run(
+        [{"out_refund_no": "refund-slow"}, {"out_refund_no": "refund-fast"}])
+    try:
+        first = next(results)
+        assert first.out_refund_no == "refund-fast"
+        assert "refund-fast" in checkpoint_path.read_text()
+    finally:
+        release.set()
+    assert [r.out_refund_no for r in results] == ["refund-slow"]
@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pywechatpay.core.client_mgr import ClientMgr
+from pywechatpay.core.downloader_mgr import CertificateDownloaderMgr
+from pywechatpay.exceptions import WechatPayException
+from .conftest import MCH_API_V3_KEY, MCH_CERT_SERIAL_NO, MCH_ID
+
+
+class CountingDownloaderMgr(CertificateDownloaderMgr):
+    """记录注册次数, 注册 blocked_mch_ids 中的商户时等待 release"""
+
+    def __init__(self, blocked_mch_ids=()):
+        super().__init__()
+        self.registered = []
+        self.blocked_mch_ids = blocked_mch_ids
+        self.release = threading.Event()
+
+    def register_downloader_with_private_key(self, mch_id, *args, **kwargs):
+        self.registered.append(mch_id)
+        if mch_id in self.blocked_mch_ids:
+            assert self.release.wait(5)
+        return super().register_downloader_with_private_key(mch_id, *args, **kwargs)
+
+
+@pytest.fixture
+def client_mgr(mock_server):
+    mgr = ClientMgr(downloader_mgr=CountingDownloaderMgr(blocked_mch_ids=("1900000002",)),
+                    api_server=mock_server.base_url)
+    yield mgr
+    mgr.downloader_mgr.release.set()
+    mgr.close()
+
+
+def test_concurrent_get_client_returns_one_instance(client_mgr, mch_private_key_string):
+    with ThreadPoolExecutor(8) as pool:
+        clients = list(pool.map(lambda _: client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string,
+                                                                 MCH_API_V3_KEY), range(16)))
+
+    assert len({id(c) for c in clients}) == 1
+    assert client_mgr.downloader_mgr.registered == [MCH_ID]
+    assert client_mgr.has_client(MCH_ID, MCH_CERT_SERIAL_NO)
+
+
+def test_clients_and_downloaders_share_one_transport(client_mgr, mch_private_key_string):
+    client = client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY)
+
+    assert client.transport is client_mgr.transport
+    assert client_mgr.downloader_mgr.downloader_map[MCH_ID].client.transport is client_mgr.transport
+
+
+def test_evict(client_mgr, mch_private_key_string):
+    client = client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY)
+
+    assert client_mgr.evict(MCH_ID, MCH_CERT_SERIAL_NO) is client
+    assert not client_mgr.has_client(MCH_ID, MCH_CERT_SERIAL_NO)
+    assert client_mgr.evict(MCH_ID, MCH_CERT_SERIAL_NO) is None
+    assert client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY) is not client
+
+
+def test_get_client_after_close_raises(client_mgr, mch_private_key_string):
+    client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY)
+    client_mgr.close()
+
+    assert not client_mgr.has_client(MCH_ID, MCH_CERT_SERIAL_NO)
+    with pytest.raises(WechatPayException):
+        client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY)
+
+
+def test_slow_merchant_does_not_block_others(mock_server, client_mgr, mch_private_key, mch_private_key_string):
+    mock_server.add_merchant("1900000002", MCH_CERT_SERIAL_NO, mch_private_key.public_key())
+    with ThreadPoolExecutor(1) as pool:
+        slow = pool.submit(client_mgr.get_client, "1900000002", MCH_CERT_SERIAL_NO, mch_private_key_string,
+                           MCH_API_V3_KEY)
+        while "1900000002" not in client_mgr.downloader_mgr.registered:
+            time.sleep(0.01)
+
+        assert client_mgr.get_client(MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY)
+        assert not slow.done()
+        client_mgr.downloader_mgr.release.set()
+        assert slow.result(5) is client_mgr.get_client("1900000002", MCH_CERT_SERIAL_NO, mch_private_key_string,
+                                                       MCH_API_V3_KEY)
@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+
+import pytest
+
+from pywechatpay.loadtest import LoadConfig, LoadContext, Sample, _Pacer, _split_concurrency, format_report, main, \
+    parse_mix, summarize
+from .conftest import APPID, MCH_API_V3_KEY, MCH_CERT_SERIAL_NO, MCH_ID
+
+
+def test_parse_mix():
+    assert parse_mix("query=8,create=2") == {"query": 8.0, "create": 2.0}
+    assert parse_mix("query, certificates=0") == {"query": 1.0}
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix("query=1,refund=1")
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix("query=0,create=0")
+
+
+def test_summarize_and_format_report():
+    samples = [Sample("query", None, 0.010, 0.001, 0.008, 0.001) for _ in range(9)]
+    samples.append(Sample("create", "ReadTimeout", 2.0, 0.001, 2.0, 0.0))
+    report = summarize(samples, 2.0)
+
+    assert report["requests"] == 10
+    assert report["errors"] == 1
+    assert report["rps"] == 5.0
+    assert report["error_types"] == {"ReadTimeout": 1}
+    assert report["endpoints"] == {"query": 9, "create": 1}
+    # 出错的请求不计入延迟
+    assert report["latency_ms"]["total"]["max"] == pytest.approx(10)
+    assert report["latency_ms"]["network"]["p50"] == pytest.approx(8)
+
+    text = format_report(report)
+    assert "requests: 10  errors: 1" in text
+    assert "error types: ReadTimeout=1" in text
+
+    assert summarize([], 0)["rps"] == 0.0
+
+
+def test_pacer_limits_rate():
+    pacer = _Pacer(100)
+    start = time.perf_counter()
+    for _ in range(11):
+        pacer.wait()
+    assert time.perf_counter() - start >= 0.09
+
+    unlimited = _Pacer(0)
+    start = time.perf_counter()
+    for _ in range(1000):
+        unlimited.wait()
+    assert time.perf_counter() - start < 0.05
+
+
+def test_split_concurrency():
+    assert _split_concurrency(6, 4) == [2, 2, 1, 1]
+    assert _split_concurrency(3, 8) == [1, 1, 1]
+    assert _split_concurrency(8, 2) == [4, 4]
+    assert sum(_split_concurrency(17, 5)) == 17
+
+
+@pytest.mark.parametrize("mode", ["threads", "processes", "asyncio"])
+def test_main_smoke(capsys, mode):
+    argv = ["--mock", "--duration", "0.2", "--format", "json", "--mode", mode, "--concurrency", "2",
+            "--processes", "2", "--mix", "query=3,create=1,certificates=1"]
+    assert main(argv) == 0
+
+    report = json.loads(capsys.readouterr().out)
+    assert report["requests"] > 0
+    assert report["errors"] == 0
+    assert report["elapsed"] < 1
+
+
+def test_warm_up_primes_platform_public_keys(mock_server, mch_private_key_string):
+    config = LoadConfig(mock_server.base_url, MCH_ID, MCH_CERT_SERIAL_NO, mch_private_key_string, MCH_API_V3_KEY,
+                        APPID, "https://example.com/notify", {"query": 1}, None, "requests", 4, True)
+    ctx = LoadContext(config)
+
+    assert ctx.warm_up_report["public_keys"] == 1
+    assert ctx.warm_up_report["opened_connections"] == 4
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pywechatpay.core.client import with_wechat_pay_auto_auth_cipher_using_downloader_mgr
+from pywechatpay.core.transport import RequestsTransport
+from pywechatpay.exceptions import WechatPayAPIException, WechatPayException
+from pywechatpay.services.payments.app import AppApiService
+from .conftest import APPID, MCH_ID
+
+
+@pytest.fixture
+def notify_receiver(notify_handler):
+    """本地回调地址, 用 notify_handler 解析收到的通知"""
+    received = []
+
+    class NotifyRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            try:
+                received.append(json.loads(notify_handler.parse_notify_request(dict(self.headers), body)))
+            except WechatPayException:
+                self.send_response(401)
+            else:
+                self.send_response(204)
+            self.end_headers()
+
+    server = HTTPServer(("127.0.0.1", 0), NotifyRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/notify", received
+    server.shutdown()
+    server.server_close()
+
+
+def test_create_query_notify_round_trip(mock_server, client, notify_receiver):
+    notify_url, received = notify_receiver
+    svc = AppApiService(client, api_server=mock_server.base_url)
+
+    result = svc.pay_transactions_app(APPID, MCH_ID, "Image形象店-深圳腾大-QQ公仔", "roundtrip-1", 100, notify_url)
+    assert result["prepay_id"].startswith("wx")
+
+    transaction = svc.pay_transactions_out_trade_no(MCH_ID, "roundtrip-1")
+    assert transaction["trade_state"] == "NOTPAY"
+    assert svc.pay_transactions_id(MCH_ID, transaction["transaction_id"])["out_trade_no"] == "roundtrip-1"
+
+    response = mock_server.pay_transaction(MCH_ID, "roundtrip-1")
+    assert response.status_code == 204
+    assert len(received) == 1
+    assert received[0]["out_trade_no"] == "roundtrip-1"
+    assert received[0]["trade_state"] == "SUCCESS"
+    assert received[0]["amount"]["payer_total"] == 100
+
+    assert svc.pay_transactions_out_trade_no(MCH_ID, "roundtrip-1")["trade_state"] == "SUCCESS"
+
+
+def test_notify_with_tampered_body_is_rejected(mock_server, notify_handler):
+    headers, body = mock_server.gen_notify({"out_trade_no": "roundtrip-2", "trade_state": "SUCCESS"})
+    assert json.loads(notify_handler.parse_notify_request(headers, body))["out_trade_no"] == "roundtrip-2"
+
+    with pytest.raises(WechatPayException):
+        notify_handler.parse_notify_request(headers, body.replace("TRANSACTION.SUCCESS", "TRANSACTION.FAILED"))
+
+
+def test_request_with_unknown_serial_is_rejected(mock_server, downloader_mgr, mch_private_key_string):
+    client = with_wechat_pay_auto_auth_cipher_using_downloader_mgr(MCH_ID, "UNKNOWNSERIAL", mch_private_key_string,
+                                                                   downloader_mgr)
+    svc = AppApiService(client, api_server=mock_server.base_url)
+
+    with pytest.raises(WechatPayAPIException):
+        svc.pay_transactions_out_trade_no(MCH_ID, "roundtrip-3")
+
+
+def test_mock_accepts_connection_bursts(mock_server):
+    transport = RequestsTransport(pool_maxsize=32)
+    start = time.perf_counter()
+    assert transport.warm_up(mock_server.base_url + "/", 32) == 32
+    # 监听队列过小时, 超出的连接要等 SYN 重传, 耗时在 1s 以上
+    assert time.perf_counter() - start < 0.8
+    transport.close()
@@ -0,0 +1,182 @@
+import asyncio
+import io
+import json
+import threading
+
+import pytest
+
+from pywechatpay.core.notify_app import MAX_BODY_SIZE, NotifyASGIApp, NotifyDispatcher, NotifyWSGIApp
+
+
+def call_wsgi(app, method="POST", body=b"", headers=None, path="/notify", content_length=True,
+              input_terminated=False):
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "wsgi.input": io.BytesIO(body),
+    }
+    if content_length:
+        environ["CONTENT_LENGTH"] = str(len(body))
+    if input_terminated:
+        environ["wsgi.input_terminated"] = True
+    for name, value in (headers or {}).items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    status = []
+    chunks = app(environ, lambda s, h: status.append(s))
+    return int(status[0].split()[0]), b"".join(chunks)
+
+
+def call_asgi(app, method="POST", body=b"", headers=None, path="/notify", chunk_size=65536):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+@pytest.fixture(params=["asgi", "wsgi"])
+def call_app(request):
+    """以 ASGI 或 WSGI 方式调用应用, 返回 (状态码, 应答主体)"""
+    app_class, call = (NotifyASGIApp, call_asgi) if request.param == "asgi" else (NotifyWSGIApp, call_wsgi)
+
+    def call_app(dispatcher, **kwargs):
+        return call(app_class(dispatcher), **kwargs)
+
+    return call_app
+
+
+def test_full_queue_returns_503(mock_server, notify_handler, call_app):
+    entered, release = threading.Event(), threading.Event()
+
+    def callback(content):
+        entered.set()
+        release.wait(5)
+
+    dispatcher = NotifyDispatcher(notify_handler, callback, workers=1, max_queue_size=1)
+    headers, body = mock_server.gen_notify({"out_trade_no": "notify-1", "trade_state": "SUCCESS"})
+    try:
+        assert call_app(dispatcher, body=body.encode(), headers=headers)[0] == 204
+        assert entered.wait(5)
+        assert call_app(dispatcher, body=body.encode(), headers=headers)[0] == 204
+        status, content = call_app(dispatcher, body=body.encode(), headers=headers)
+        assert status == 503
+        assert json.loads(content)["code"] == "FAIL"
+    finally:
+        release.set()
+        dispatcher.stop(5)
+
+    metrics = dispatcher.metrics()
+    assert (metrics["accepted"], metrics["rejected"], metrics["processed"]) == (2, 1, 2)
+
+
+@pytest.mark.parametrize("body, status", [(b"\xff\xfe", 400), (b"", 400), (b"x" * (MAX_BODY_SIZE + 1), 413)])
+def test_invalid_body_is_not_queued(notify_handler, call_app, body, status):
+    dispatcher = NotifyDispatcher(notify_handler, lambda content: None)
+
+    assert call_app(dispatcher, body=body)[0] == status
+    assert dispatcher.metrics()["accepted"] == 0
+
+
+def test_metrics_and_method_not_allowed(notify_handler, call_app):
+    dispatcher = NotifyDispatcher(notify_handler, lambda content: None)
+
+    status, content = call_app(dispatcher, method="GET", path="/metrics")
+    assert status == 200
+    assert json.loads(content)["failed"] == {"parse": 0, "callback": 0}
+    assert call_app(dispatcher, method="GET", path="/notify")[0] == 405
+
+
+def test_asgi_lifespan_starts_and_stops_dispatcher(notify_handler):
+    dispatcher = NotifyDispatcher(notify_handler, lambda content: None, workers=2)
+    app = NotifyASGIApp(dispatcher)
+    sent = []
+
+    async def run():
+        messages = asyncio.Queue()
+
+        async def send(message):
+            sent.append(message)
+
+        task = asyncio.ensure_future(app({"type": "lifespan"}, messages.get, send))
+        await messages.put({"type": "lifespan.startup"})
+        while not sent:
+            await asyncio.sleep(0.01)
+        assert len(dispatcher.threads) == 2
+        await messages.put({"type": "lifespan.shutdown"})
+        await task
+
+    asyncio.run(run())
+    assert [m["type"] for m in sent] == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert dispatcher.threads == []
+
+
+def test_wsgi_without_content_length(mock_server, notify_handler):
+    processed = threading.Event()
+    dispatcher = NotifyDispatcher(notify_handler, lambda content: processed.set(), workers=1)
+    app = NotifyWSGIApp(dispatcher)
+    headers, body = mock_server.gen_notify({"out_trade_no": "notify-4", "trade_state": "SUCCESS"})
+
+    # 服务器不保证 wsgi.input 在主体结束处返回 EOF 时无法读取主体
+    assert call_wsgi(app, body=body.encode(), headers=headers, content_length=False)[0] == 411
+    # 分块传输
+    assert call_wsgi(app, body=body.encode(), headers=headers, content_length=False, input_terminated=True)[0] == 204
+    assert processed.wait(5)
+    dispatcher.stop(5)
+
+    metrics = dispatcher.metrics()
+    assert (metrics["accepted"], metrics["processed"]) == (1, 1)
+    assert metrics["failed"] == {"parse": 0, "callback": 0}
+
+
+def test_callback_is_retried_and_failures_are_split_by_cause(mock_server, notify_handler):
+    calls, errors = [], []
+
+    def callback(content):
+        calls.append(content)
+        if len(calls) < 3:
+            raise RuntimeError("database unavailable")
+
+    dispatcher = NotifyDispatcher(notify_handler, callback, workers=1, callback_retries=2, retry_backoff=0.01,
+                                  on_error=lambda ex, headers, body: errors.append(ex))
+    headers, body = mock_server.gen_notify({"out_trade_no": "notify-2", "trade_state": "SUCCESS"})
+    dispatcher.submit(headers, body)
+    dispatcher.submit(headers, body.replace("TRANSACTION.SUCCESS", "TRANSACTION.FAILED"))
+    dispatcher.stop(5)
+
+    metrics = dispatcher.metrics()
+    assert len(calls) == 3
+    assert json.loads(calls[-1])["out_trade_no"] == "notify-2"
+    assert metrics["processed"] == 1
+    assert metrics["retried"] == 2
+    assert metrics["failed"] == {"parse": 1, "callback": 0}
+    assert len(errors) == 1
+
+
+def test_callback_failure_after_retries_goes_to_on_error(mock_server, notify_handler):
+    errors = []
+
+    def callback(content):
+        raise RuntimeError("database unavailable")
+
+    dispatcher = NotifyDispatcher(notify_handler, callback, workers=1, callback_retries=1, retry_backoff=0.01,
+                                  on_error=lambda ex, headers, body: errors.append(ex))
+    headers, body = mock_server.gen_notify({"out_trade_no": "notify-3", "trade_state": "SUCCESS"})
+    dispatcher.submit(headers, body)
+    dispatcher.stop(5)
+
+    assert dispatcher.metrics()["failed"] == {"parse": 0, "callback": 1}
+    assert [str(ex) for ex in errors] == ["database unavailable"]
@@ -0,0 +1,87 @@
+import threading
+
+from pywechatpay.services.payments.app import AppApiService
+from pywechatpay.services.payments.poller import OrderStatusPoller
+from .conftest import MCH_ID
+
+
+def test_order_is_removed_after_final_state(mock_server, client):
+    mock_server.create_transaction("app", MCH_ID, {"mchid": MCH_ID, "out_trade_no": "poll-1", "amount": {"total": 1}})
+    finished = threading.Event()
+    results = []
+
+    def callback(result):
+        results.append(result)
+        finished.set()
+
+    poller = OrderStatusPoller(AppApiService(client, api_server=mock_server.base_url), callback,
+                               min_interval=0.05, max_interval=0.05)
+    poller.start()
+    try:
+        assert poller.add(MCH_ID, "poll-1")
+        assert not poller.add(MCH_ID, "poll-1")
+        mock_server.transactions[(MCH_ID, "poll-1")]["trade_state"] = "CLOSED"
+        assert finished.wait(5)
+    finally:
+        poller.stop()
+
+    assert [r["trade_state"] for r in results] == ["CLOSED"]
+    assert len(poller) == 0
+    assert not poller.remove(MCH_ID, "poll-1")
+
+
+def test_callback_and_expire_errors_go_to_on_error():
+    class Service:
+        def pay_transactions_out_trade_no(self, mchid, out_trade_no):
+            return {"out_trade_no": out_trade_no, "trade_state": "SUCCESS"}
+
+    def callback(result):
+        raise RuntimeError("callback failed")
+
+    def on_expire(mchid, out_trade_no):
+        raise RuntimeError("expire failed")
+
+    errors = []
+    reported = threading.Semaphore(0)
+
+    def on_error(mchid, out_trade_no, ex):
+        errors.append((out_trade_no, str(ex)))
+        reported.release()
+
+    poller = OrderStatusPoller(Service(), callback, min_interval=0.01, max_interval=0.01, max_age=60,
+                               on_expire=on_expire, on_error=on_error)
+    poller.add(MCH_ID, "poll-2")
+    poller.add(MCH_ID, "poll-3", created_at=0)
+    poller.start()
+    try:
+        assert reported.acquire(timeout=5) and reported.acquire(timeout=5)
+    finally:
+        poller.stop()
+
+    assert sorted(errors) == [("poll-2", "callback failed"), ("poll-3", "expire failed")]
+    assert len(poller) == 0
+
+
+def test_slow_on_expire_does_not_block_polling():
+    class Service:
+        def pay_transactions_out_trade_no(self, mchid, out_trade_no):
+            return {"out_trade_no": out_trade_no, "trade_state": "SUCCESS"}
+
+    expiring, release, finished = threading.Event(), threading.Event(), threading.Event()
+
+    def on_expire(mchid, out_trade_no):
+        expiring.set()
+        release.wait(5)
+
+    poller = OrderStatusPoller(Service(), lambda result: finished.set(), concurrency=2, min_interval=0.01,
+                               max_interval=0.01, max_age=60, on_expire=on_expire)
+    poller.add(MCH_ID, "poll-4", created_at=0)
+    poller.start()
+    try:
+        assert expiring.wait(5)
+        poller.add(MCH_ID, "poll-5")
+        assert finished.wait(5)
+    finally:
+        release.set()
+        poller.stop()
+    assert len(poller) == 0
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+import requests
+
+from pywechatpay.core.timeout import TimeoutPolicy, current_deadline, deadline
+from pywechatpay.core.transport import HttpResponse, Transport
+from pywechatpay.exceptions import WechatPayTimeoutException
+from pywechatpay.services.payments.app import AppApiService
+from .conftest import MCH_ID, unused_port
+
+
+class StubTransport(Transport):
+    """记录请求次数, 按顺序抛出 errors 中的异常, 用完后等待 delay 秒再返回 200"""
+
+    retryable_exceptions = (ConnectionError,)
+
+    def __init__(self, errors=(), delay: float = 0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.timeouts = []
+
+    def request(self, method, url, headers, body=None, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.delay:
+            time.sleep(self.delay)
+        return HttpResponse(200, {}, b"{}")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录 time.sleep 的参数而不真正等待"""
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    return delays
+
+
+def test_nested_deadline_takes_the_earlier_one():
+    assert current_deadline() is None
+    with deadline(10) as outer:
+        with deadline(1) as inner:
+            assert inner < outer
+            assert current_deadline() == inner
+        with deadline(20):
+            assert current_deadline() == outer
+    assert current_deadline() is None
+
+
+def test_attempt_timeout_is_clipped_to_deadline(client):
+    client.timeout_policy = TimeoutPolicy(connect=5, read=10)
+    connect, read = client._attempt_timeout("GET", "/v3/certificates", None, time.monotonic() + 1)
+    assert 0 < connect < read and connect + read <= 1
+
+    connect, read = client._attempt_timeout("GET", "/v3/certificates", 30, time.monotonic() + 1)
+    assert connect == pytest.approx(read) and connect + read <= 1
+    assert client._attempt_timeout("GET", "/v3/certificates", (1, 2), time.monotonic() + 10) == (1, 2)
+
+    with pytest.raises(WechatPayTimeoutException):
+        client._attempt_timeout("GET", "/v3/certificates", None, time.monotonic() - 1)
+
+
+def test_deadline_exceeded_raises_timeout_exception(mock_server, client):
+    svc = AppApiService(client, api_server=mock_server.base_url)
+    client.retries = 3
+    mock_server.latency = 2
+
+    start = time.monotonic()
+    with pytest.raises(WechatPayTimeoutException) as exc_info:
+        with deadline(0.5):
+            svc.pay_transactions_out_trade_no(MCH_ID, "timeout-1")
+    assert time.monotonic() - start < 1.5
+    assert isinstance(exc_info.value.__cause__, requests.Timeout)
+
+
+def test_retries_back_off_before_giving_up(client, sleeps):
+    client.transport = StubTransport(errors=[ConnectionError("refused")] * 4)
+    client.retries = 3
+    client.retry_backoff = 0.1
+
+    with pytest.raises(ConnectionError):
+        client.request("get", "http://127.0.0.1/v3/certificates")
+
+    assert len(client.transport.timeouts) == 4
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay < 0.1 * 2 ** attempt
+    assert len(set(sleeps)) > 1
+
+
+def test_retry_succeeds_after_connection_errors(client, sleeps):
+    client.transport = StubTransport(errors=[ConnectionError("refused")] * 2)
+    client.retries = 2
+    client.validator = type("NullValidator", (), {"validate": lambda self, headers, body: None})()
+
+    assert client.request("get", "http://127.0.0.1/v3/certificates").status_code == 200
+    assert len(client.transport.timeouts) == 3
+    assert len(sleeps) == 2
+
+
+def test_backoff_is_clipped_to_deadline(client, sleeps):
+    client.transport = StubTransport(errors=[ConnectionError("refused")] * 2)
+    client.retries = 1
+    client.retry_backoff = 100
+
+    with pytest.raises(ConnectionError):
+        with deadline(0.5):
+            client.request("get", "http://127.0.0.1/v3/certificates")
+    assert len(sleeps) == 1 and sleeps[0] <= 0.5
+
+
+def test_response_after_deadline_raises_timeout_exception(client):
+    client.transport = StubTransport(delay=0.3)
+
+    with pytest.raises(WechatPayTimeoutException):
+        client.request("get", "http://127.0.0.1/v3/certificates", deadline=time.monotonic() + 0.1)
+
+
+def test_refused_connection_is_raised_after_retries(client):
+    client.retries = 1
+    client.retry_backoff = 0.01
+
+    with pytest.raises(requests.ConnectionError):
+        client.request("get", f"http://127.0.0.1:{unused_port()}/v3/certificates")
+
+
+def test_adaptive_policy_only_adapts_read_timeout():
+    policy = TimeoutPolicy(connect=3, read=10, adaptive=True, min_read_timeout=0.5, min_samples=5)
+    for _ in range(5):
+        policy.observe("GET", "/v3/certificates", 0.1)
+    assert policy.get_timeout("GET", "/v3/certificates") == (3, 0.5)
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+import urllib3
+
+from pywechatpay.core.timeout import TimeoutPolicy
+from pywechatpay.core.transport import Urllib3Transport, new_transport
+from pywechatpay.services.payments.app import AppApiService
+from .conftest import MCH_ID, unused_port
+
+
+@pytest.mark.parametrize("name", ["requests", "urllib3"])
+def test_round_trip_over_transport(mock_server, client, name):
+    client.transport = new_transport(name)
+    svc = AppApiService(client, api_server=mock_server.base_url)
+    mock_server.create_transaction("app", MCH_ID, {"mchid": MCH_ID, "out_trade_no": "transport-1",
+                                                   "amount": {"total": 1}})
+
+    assert svc.pay_transactions_out_trade_no(MCH_ID, "transport-1")["trade_state"] == "NOTPAY"
+
+
+def test_refused_connection_is_not_observed_as_timeout(client):
+    transport = Urllib3Transport()
+    client.transport = transport
+    client.timeout_policy = TimeoutPolicy(adaptive=True)
+    url = f"http://127.0.0.1:{unused_port()}/v3/certificates"
+
+    with pytest.raises(urllib3.exceptions.NewConnectionError) as exc_info:
+        client.request("get", url)
+    assert not transport.is_timeout(exc_info.value)
+    assert transport.is_timeout(urllib3.exceptions.ReadTimeoutError(None, url, "read timed out"))
+    assert not client.timeout_policy.default.latencies
+
+
+def test_warm_up_is_clamped_to_pool_size(mock_server, client):
+    report = client.warm_up(connections=16, api_server=mock_server.base_url)
+    assert report["opened_connections"] == 10
+    assert report["public_keys"] == 1
+
+    client.transport = Urllib3Transport(maxsize=2)
+    assert client.warm_up(connections=16, api_server=mock_server.base_url)["opened_connections"] == 2
+
+
+def test_warm_up_async(mock_server, client):
+    report = asyncio.run(client.warm_up_async(connections=2, api_server=mock_server.base_url))
+    assert report["opened_connections"] == 2
+
+
+def test_httpx_pool_size():
+    pytest.importorskip("httpx")
+    transport = new_transport("httpx")
+    # HTTP/2 只在 https 上协商, 所有请求复用同一个连接
+    assert transport.pool_size("https://api.mch.weixin.qq.com/") == 1
+    assert transport.pool_size("http://127.0.0.1:8000/") == 20
+    assert new_transport("httpx", http2=False).pool_size("https://api.mch.weixin.qq.com/") == 20
+    transport.close()